@@ -18,13 +18,7 @@ sys.path.append("../")
 
 from kge_qa.kgeqa.main import answer
 from kge_qa.kgeqa.params import HOWTO_VIDEO_PATH
-from kge_qa.kgeqa.model import (
-    ENTITY_VECTORS_MODEL,
-    RELATION_VECTORS_MODEL,
-    ENTITY_VECTORS_KEYS,
-    RELATION_VECTORS_KEYS,
-    KG_DATABASE,
-)
+from kge_qa.kgeqa import load_models as models
 from kge_qa.kgeqa.utils.logger import logging
 
 
@@ -99,7 +93,7 @@ def st_draw_answer_triplet(h, r, t):
     temp = temp.replace("HEAD", f"{h}")
     temp = temp.replace("TAIL", f"{t}")
     temp = temp.replace("RELATION", f"{r}")
-    print(temp)
+    logging.debug("answer triplet graph:\n%s", temp)
     st.graphviz_chart(temp)
 
 
@@ -124,12 +118,12 @@ def _sb_entities_model():
         w = st.sidebar.text_input("Type a word to find its closest entities:")
         if w:
             # -- display dataframe
-            result = ENTITY_VECTORS_MODEL.most_similar(w)
+            result = models.ENTITY_VECTORS_MODEL.most_similar(w)
             st.sidebar.dataframe(result)
 
             # -- show visualization
             if st.sidebar.button("Show plot"):
-                tsne_plot_most_similar(w, ENTITY_VECTORS_MODEL, 30, "ENTITIES")
+                tsne_plot_most_similar(w, models.ENTITY_VECTORS_MODEL, 30, "ENTITIES")
 
 
 def _sb_relations_model():
@@ -137,35 +131,35 @@ def _sb_relations_model():
         w = st.sidebar.text_input("Type a word to find its closest relations:")
         if w:
             # -- display dataframe
-            result = RELATION_VECTORS_MODEL.most_similar(w)
+            result = models.RELATION_VECTORS_MODEL.most_similar(w)
             st.sidebar.dataframe(result)
 
             # -- show visualization
             if st.sidebar.button("Show plot"):
-                tsne_plot_most_similar(w, RELATION_VECTORS_MODEL, 20, "RELATIONS")
+                tsne_plot_most_similar(w, models.RELATION_VECTORS_MODEL, 20, "RELATIONS")
 
 
 def _sb_display_supported_ents_rels():
     if not st.sidebar.checkbox("View ENT/REL keys"):
         return
-    n = len(ENTITY_VECTORS_KEYS)
+    n = len(models.ENTITY_VECTORS_KEYS)
     if st.sidebar.button(f"{n} entities"):
-        st.sidebar.dataframe(ENTITY_VECTORS_KEYS)
+        st.sidebar.dataframe(models.ENTITY_VECTORS_KEYS.tolist())
 
-    n = len(RELATION_VECTORS_KEYS)
+    n = len(models.RELATION_VECTORS_KEYS)
     if st.sidebar.button(f"{n} relations"):
-        st.sidebar.dataframe(RELATION_VECTORS_KEYS)
+        st.sidebar.dataframe(models.RELATION_VECTORS_KEYS.tolist())
 
 
 def _sb_display_kg_facts():
     if not st.sidebar.checkbox("View supported facts"):
         return
-    df = KG_DATABASE  # read_kg_dataset()
+    df = models.KG_DATABASE  # read_kg_dataset()
 
     # -- render dataframe
     st.markdown("<hr>")
 
-    st.write(f"> Number of facts: {KG_DATABASE.shape[0]}")
+    st.write(f"> Number of facts: {models.KG_DATABASE.shape[0]}")
     term = st.text_input("Search for a fact:")
     if term:
         # search `term` in df
@@ -177,7 +171,7 @@ def _sb_display_kg_facts():
             ]
         )
     else:
-        st.dataframe(KG_DATABASE)
+        st.dataframe(models.KG_DATABASE)
 
 
 def _sb_display_kg_facts_and_questions_ontology():
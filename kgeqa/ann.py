@@ -0,0 +1,125 @@
+"""
+Approximate nearest-neighbor (IVF) index for large ENT/REL vocabularies
+
+A pure-NumPy inverted file index: the unit vectors are clustered with spherical
+k-means, and a query only scores the rows of its `n_probe` closest clusters.
+`n_probe` is the recall/latency knob (`n_probe == n_lists` is an exact search).
+
+The index is saved next to the model it was built from, e.g.
+`data/ENT.vec.magnitude.ivf.npz`.
+"""
+from typing import Tuple
+
+import numpy as np
+
+from .config import Tensor
+from .utils.files import atomic_write
+
+ANN_SUFFIX = ".ivf.npz"
+
+
+def ann_index_path(model_path: str) -> str:
+    """e.g. data/ENT.vec.magnitude -> data/ENT.vec.magnitude.ivf.npz"""
+    return f"{model_path}{ANN_SUFFIX}"
+
+
+class IVFIndex:
+    centroids: Tensor  # (n_lists, dim) unit vectors
+    offsets: Tensor  # (n_lists + 1,) start of each list in `rows`
+    rows: Tensor  # (n,) matrix row ids grouped by list
+
+    def __init__(self, centroids: Tensor, offsets: Tensor, rows: Tensor):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        matrix: Tensor,
+        n_lists: int = 0,
+        n_iter: int = 10,
+        sample_size: int = 100000,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """clusters the (unit) rows of `matrix` into `n_lists` lists (default ~4 * sqrt(n))"""
+        n = len(matrix)
+        n_lists = max(1, min(n, n_lists or int(4 * np.sqrt(n))))
+        rng = np.random.RandomState(seed)
+        sample = matrix[rng.choice(n, min(n, sample_size), replace=False)]
+        sample = np.asarray(sample, dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(n_iter):
+            assigned = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assigned, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            sums[~empty] /= norms[~empty]
+            sums[empty] = centroids[empty]  # keep the old centroid of an empty list
+            centroids = sums
+        return cls.from_assignments(centroids, cls._assign(matrix, centroids))
+
+    @classmethod
+    def from_assignments(cls, centroids: Tensor, assigned: Tensor) -> "IVFIndex":
+        rows = np.argsort(assigned, kind="stable").astype(np.int32)
+        counts = np.bincount(assigned, minlength=len(centroids))
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(centroids, offsets, rows)
+
+    def add(self, vectors: Tensor) -> None:
+        """adds the (unit) `vectors` of new matrix rows, numbered from `len(self.rows)`,
+        to their closest lists (the centroids are kept as is)
+        """
+        assigned = np.empty(len(self.rows) + len(vectors), dtype=np.int64)
+        assigned[self.rows] = np.repeat(np.arange(self.n_lists), np.diff(self.offsets))
+        assigned[len(self.rows) :] = self._assign(vectors, self.centroids)
+        index = self.from_assignments(self.centroids, assigned)
+        self.offsets, self.rows = index.offsets, index.rows
+
+    @staticmethod
+    def _assign(matrix: Tensor, centroids: Tensor, block: int = 65536) -> Tensor:
+        """nearest centroid of every row of `matrix`, scored block by block"""
+        assigned = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), block):
+            rows = np.asarray(matrix[start : start + block], dtype=np.float32)
+            assigned[start : start + len(rows)] = np.argmax(rows @ centroids.T, axis=1)
+        return assigned
+
+    def candidates(self, query: Tensor, n_probe: int) -> Tensor:
+        """row ids in the `n_probe` lists closest to `query`"""
+        n_probe = min(n_probe, self.n_lists)
+        lists = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        return np.concatenate(
+            [self.rows[self.offsets[i] : self.offsets[i + 1]] for i in lists]
+        )
+
+    def search(
+        self, matrix: Tensor, queries: Tensor, k: int, n_probe: int = 16
+    ) -> Tuple[Tensor, Tensor]:
+        """(row ids, scores) of the `k` closest rows of `matrix` to each query, best first"""
+        k = min(k, len(matrix))
+        ids = np.zeros((len(queries), k), dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for qi, query in enumerate(queries):
+            cands = self.candidates(query, n_probe)
+            cand_scores = np.asarray(matrix[cands], dtype=np.float32) @ query
+            top = np.argsort(-cand_scores)[:k]
+            ids[qi, : len(top)] = cands[top]
+            scores[qi, : len(top)] = cand_scores[top]
+        return ids, scores
+
+    def save(self, path: str) -> None:
+        # -- np.savez appends ".npz" to paths without it
+        with atomic_write(path) as out:
+            np.savez(out, centroids=self.centroids, offsets=self.offsets, rows=self.rows)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["offsets"], data["rows"])
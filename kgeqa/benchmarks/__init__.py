@@ -0,0 +1,3 @@
+"""
+Offline benchmarks of the answering pipeline and the model builder, see `bench.py`
+"""
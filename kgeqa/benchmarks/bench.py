@@ -0,0 +1,399 @@
+"""
+Benchmarks of the answering pipeline and of the model builder
+
+Runs offline: the models are built from the bundled KG datasets with a synthetic word model
+(see `kgeqa.benchmarks.synthetic`), in a temporary directory. Measures, for each KG:
+    - cold start of `load_models` (each resource, from the files the builder writes)
+    - `tokenize`, `decide_closest_neighbor` (cold and warm caches), `pick_potential_pair`
+      and `find_closest_pair_in_kg`, per call
+    - `answer()` end-to-end (cold and cached) and `answer_batch()`: throughput, p50/p99
+    - the facts snapshot written in memory and streamed in chunks (checked to hold the same facts)
+and `BuildKGModels.run` on the first `--build_sizes` facts of `--build_kg`
+(needs `pymagnitude` for the .magnitude conversion, skipped otherwise).
+
+Usage:
+
+    $ python -m kgeqa.benchmarks.bench --output bench.json
+    $ python -m kgeqa.benchmarks.bench --kg data/sample1_KG.csv --n_questions 100
+    $ python -m kgeqa.benchmarks.bench --build_sizes 1000 10000 --baseline bench.json
+
+The results are written as JSON (`--output`), and compared to a previous run's if
+`--baseline` is given (the ratio new/old of every timing).
+"""
+import json
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterable, List
+
+import numpy as np
+
+from .. import load_models as models
+from .. import metrics
+from ..config import Token
+from ..params import PARENT_DIR
+from .synthetic import SyntheticWordModel, register_models, write_models
+
+DEFAULT_KGS = [
+    f"{PARENT_DIR}/data/KG.csv",
+    f"{PARENT_DIR}/data/sample1_KG.csv",
+    f"{PARENT_DIR}/data/sample2_KG.csv",
+]
+NO_ANSWER = ["No answer found!"]
+RESOURCES = [
+    "EMBEDDING_MODEL",
+    "ENTITY_VECTORS_KEYS",
+    "RELATION_VECTORS_KEYS",
+    "NEIGHBOR_ENGINE",
+    "KG_FACTS",
+]
+
+
+def latency_stats(seconds: Iterable[float]) -> Dict[str, float]:
+    """count, total, mean, p50, p99 (seconds) and calls per second of per-call `seconds`"""
+    seconds = np.asarray(list(seconds), dtype=np.float64)
+    if not len(seconds):
+        return dict(n=0)
+    total = float(seconds.sum())
+    return dict(
+        n=len(seconds),
+        total=total,
+        mean=float(seconds.mean()),
+        p50=float(np.percentile(seconds, 50)),
+        p99=float(np.percentile(seconds, 99)),
+        per_second=len(seconds) / total if total else float("inf"),
+    )
+
+
+def time_calls(func: Callable, calls: Iterable[tuple]) -> Dict[str, float]:
+    """latency stats of `func(*args)` for each `args` in `calls`"""
+    seconds = []
+    for args in calls:
+        start = time.perf_counter()
+        func(*args)
+        seconds.append(time.perf_counter() - start)
+    return latency_stats(seconds)
+
+
+def make_questions(n: int, seed: int = 0) -> List[str]:
+    """questions about `n` random facts of the loaded KG, every other one with a misspelled
+    head (so that its tokens go through the neighbor search instead of matching a key)
+    """
+    facts = models.KG_FACTS
+    random = np.random.RandomState(seed)
+    rows = random.choice(len(facts), min(n, len(facts)), replace=False)
+    questions = []
+    for i, row in enumerate(rows.tolist()):
+        head = facts.entities[int(facts.heads[row])].split("_")
+        relation = facts.relations[int(facts.relation_codes[row])].replace("_", " ")
+        if i % 2:
+            longest = max(range(len(head)), key=lambda j: len(head[j]))
+            head[longest] = head[longest][:-1] or head[longest]
+        questions.append(f"what is the {relation} of {' '.join(head)}?")
+    return questions
+
+
+def bench_cold_start(repeat: int = 3) -> Dict[str, Any]:
+    """time to load each resource after `load_models.reset()` (mean over `repeat` loads)"""
+    times = {name: [] for name in RESOURCES}
+    totals = []
+    for _ in range(repeat):
+        models.reset()
+        start = time.perf_counter()
+        for name in RESOURCES:
+            models.get(name)
+        totals.append(time.perf_counter() - start)
+        for name in RESOURCES:
+            times[name].append(models.LOAD_TIMES.get(name, 0.0))
+    return dict(
+        total=latency_stats(totals),
+        resources={name: float(np.mean(t)) for name, t in times.items()},
+    )
+
+
+def bench_phases(questions: List[str]) -> Dict[str, Any]:
+    """per-call latencies of the pipeline functions, over the tokens/pairs of `questions`"""
+    from ..main import KGE_QA
+    from ..model import (
+        decide_closest_neighbor,
+        find_closest_pair_in_kg,
+        generate_embeddings,
+        is_true_key,
+        pick_potential_pair,
+    )
+    from .. import preprocess
+    from ..preprocess import tokenize
+    from ..utils.stress_test import reset_caches
+
+    reset_caches()
+    # -- the multi-word keys trie, built on the first `tokenize()` call
+    preprocess._SPAN_TRIE.clear()
+    results = dict(span_trie=time_calls(preprocess._span_trie, [()]))
+    results["tokenize"] = time_calls(lambda q: list(tokenize(q)), [(q,) for q in questions])
+
+    # -- the tokens that are not keys, embedded beforehand (not timed)
+    names = list(
+        {t.name: None for q in questions for t in tokenize(q) if not is_true_key(t)}
+    )
+    tokens = [Token(name, vector=v) for name, v in zip(names, generate_embeddings(names))]
+    results["decide_closest_neighbor"] = dict(
+        cold=time_calls(decide_closest_neighbor, [(t, []) for t in tokens]),
+        warm=time_calls(decide_closest_neighbor, [(t, []) for t in tokens]),
+    )
+
+    # -- the candidate pairs of each question (phases 1-3, not timed)
+    candidate_pairs = []
+    for question in questions:
+        kgeqa = KGE_QA()
+        kgeqa.tokenize(question)
+        kgeqa._phase1_identify_and_label_tokens()
+        kgeqa._phase2_swap_from_input_to_kg_tokens()
+        kgeqa._phase3_form_incomplete_triplets()
+        if kgeqa.candidate_pairs:
+            candidate_pairs.append(kgeqa.candidate_pairs)
+    results["pick_potential_pair"] = time_calls(
+        pick_potential_pair, [(pairs,) for pairs in candidate_pairs]
+    )
+    picked = [pick_potential_pair(pairs) for pairs in candidate_pairs]
+    results["find_closest_pair_in_kg"] = time_calls(find_closest_pair_in_kg, picked)
+    return results
+
+
+def bench_answer(questions: List[str]) -> Dict[str, Any]:
+    """`answer()` per question with cold caches then cached, and `answer_batch()`"""
+    from ..main import answer, answer_batch
+    from ..utils.stress_test import reset_caches
+
+    reset_caches()
+    metrics.reset()
+    cold = time_calls(answer, [(q,) for q in questions])
+    phases = metrics.stats()["phases"]  # -- where the cold answers spent their time
+    cached = time_calls(answer, [(q,) for q in questions])
+    reset_caches()
+    start = time.perf_counter()
+    answers = answer_batch(questions)
+    batch_time = time.perf_counter() - start
+    answered = sum(
+        1 for _, _, result in answers if isinstance(result, list) and result != NO_ANSWER
+    )
+    return dict(
+        cold=cold,
+        cached=cached,
+        batch=dict(n=len(questions), total=batch_time, per_second=len(questions) / batch_time),
+        answered=answered / max(len(questions), 1),
+        phases={
+            phase: {k: v for k, v in stats.items() if k != "buckets"}
+            for phase, stats in phases.items()
+        },
+    )
+
+
+def _facts(store) -> List[tuple]:
+    """the (h, r, t) names of the facts of `store`, sorted (the ids differ between stores)"""
+    return sorted(map(tuple, store.to_dataframe().astype(str).values.tolist()))
+
+
+def bench_snapshot(kg_csv: str, out_dir: str, chunksize: int = 10000) -> Dict[str, Any]:
+    """facts snapshot written from the whole KG and streamed `chunksize` facts at a time,
+    and whether both hold the same facts
+    """
+    from ..fact_store import FactStore
+    from ..kg_reader import read_kg
+
+    start = time.perf_counter()
+    in_memory = FactStore.from_dataframe(read_kg(kg_csv, lower=()))
+    in_memory.save(os.path.join(out_dir, "facts_in_memory"))
+    in_memory_time = time.perf_counter() - start
+    start = time.perf_counter()
+    streamed = FactStore.write_snapshot(
+        read_kg(kg_csv, lower=(), chunksize=chunksize),
+        os.path.join(out_dir, "facts_streamed"),
+        block_size=chunksize,
+    )
+    streamed_time = time.perf_counter() - start
+    return dict(
+        in_memory=dict(seconds=in_memory_time),
+        streamed=dict(seconds=streamed_time, chunksize=chunksize),
+        consistent=_facts(in_memory) == _facts(streamed),
+    )
+
+
+def bench_kg(
+    kg_csv: str, word_model: SyntheticWordModel, out_dir: str, n_questions: int, seed: int
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    paths = write_models(kg_csv, out_dir, word_model)
+    setup_time = time.perf_counter() - start
+    register_models(paths, word_model)
+    cold_start = bench_cold_start()
+    facts = models.KG_FACTS
+    questions = make_questions(n_questions, seed)
+    return dict(
+        kg=kg_csv,
+        facts=len(facts),
+        entities=len(models.ENTITY_VECTORS_KEYS),
+        relations=len(models.RELATION_VECTORS_KEYS),
+        questions=len(questions),
+        setup_time=setup_time,
+        cold_start=cold_start,
+        functions=bench_phases(questions),
+        answer=bench_answer(questions),
+        snapshot=bench_snapshot(kg_csv, out_dir),
+    )
+
+
+def bench_build(
+    kg_csv: str, sizes: List[int], word_model: SyntheticWordModel, out_dir: str
+) -> Dict[str, Any]:
+    """`BuildKGModels.run` time on the first `sizes` facts of `kg_csv`"""
+    import contextlib
+    import io
+
+    try:
+        from ..build_new_model import BuildKGModels
+    except ImportError as e:  # -- pymagnitude converts the models
+        return dict(skipped=f"cannot import the builder: {e}")
+
+    models.register("WORD_VECTORS_MODEL", lambda: word_model)
+    with open(kg_csv) as in_file:
+        header, lines = in_file.readline(), in_file.readlines()
+    results = {}
+    # -- the sizes beyond the whole KG are built once, from the whole KG
+    sizes = sorted(set(min(size, len(lines)) for size in sizes))
+    for size in sizes:
+        build_dir = os.path.join(out_dir, f"build_{size}")
+        os.makedirs(build_dir, exist_ok=True)
+        csv_file = os.path.join(build_dir, "input.csv")
+        with open(csv_file, "w") as out_file:
+            out_file.write(header)
+            out_file.writelines(lines[:size])
+        builder = BuildKGModels()
+        builder.ENT_VEC_OUTPUT = os.path.join(build_dir, "ENT.vec")
+        builder.REL_VEC_OUTPUT = os.path.join(build_dir, "REL.vec")
+        builder.WORD_VEC_OUTPUT = os.path.join(build_dir, "WORDS.vec")
+        builder.KG_OUTPUT = os.path.join(build_dir, "KG.csv")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # -- the builder prints its progress
+            builder.run(csv_file)
+        seconds = time.perf_counter() - start
+        results[str(size)] = dict(facts=size, seconds=seconds, facts_per_second=size / seconds)
+    return dict(kg=kg_csv, runs=results)
+
+
+def _flatten(tree: Any, prefix: str = "") -> Dict[str, float]:
+    if isinstance(tree, dict):
+        flat = {}
+        for key, value in tree.items():
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        return flat
+    if isinstance(tree, (int, float)) and not isinstance(tree, bool):
+        return {prefix[:-1]: float(tree)}
+    return {}
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """'<timing>: old -> new (x ratio)' lines for the timings found in both runs"""
+    timings = ("total", "mean", "p50", "p99", "seconds", "setup_time")
+    new, old = _flatten(results["results"]), _flatten(baseline["results"])
+    lines = []
+    for key, value in new.items():
+        parts = key.split(".")
+        if not (parts[-1] in timings or parts[-2] == "resources"):
+            continue
+        if old.get(key):
+            lines.append(f"{key}: {old[key]:.6f} -> {value:.6f} (x{value / old[key]:.2f})")
+    return lines
+
+
+def _meta(args) -> Dict[str, Any]:
+    import platform
+    import subprocess
+
+    from .. import params
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PARENT_DIR,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return dict(
+        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        commit=commit or None,
+        python=platform.python_version(),
+        numpy=np.__version__,
+        platform=platform.platform(),
+        dim=args.dim,
+        n_questions=args.n_questions,
+        seed=args.seed,
+        params=dict(
+            NEIGHBORS_DTYPE=params.NEIGHBORS_DTYPE,
+            NEIGHBORS_MMAP=params.NEIGHBORS_MMAP,
+            NEIGHBORS_TOP_N=params.NEIGHBORS_TOP_N,
+            ANN_N_PROBE=params.ANN_N_PROBE,
+        ),
+    )
+
+
+def main(args) -> Dict[str, Any]:
+    word_model = SyntheticWordModel(args.dim)
+    # -- keyed by KG file name (and build size), so runs are compared KG by KG
+    results = dict(meta=_meta(args), results=dict(pipeline={}))
+    with tempfile.TemporaryDirectory(prefix="kgeqa_bench_") as tmp:
+        for i, kg_csv in enumerate(args.kg):
+            print(f"Benchmarking the pipeline on {kg_csv} ..")
+            out_dir = os.path.join(tmp, f"kg_{i}")
+            kg_results = bench_kg(kg_csv, word_model, out_dir, args.n_questions, args.seed)
+            results["results"]["pipeline"][os.path.basename(kg_csv)] = kg_results
+            cold_start = kg_results["cold_start"]["total"]["mean"]
+            cold, batch = kg_results["answer"]["cold"], kg_results["answer"]["batch"]
+            print(
+                f"  {kg_results['facts']} facts, cold start {cold_start:.3f}s, "
+                f"answer() {cold['per_second']:.0f}/s (p50 {cold['p50'] * 1000:.2f}ms, "
+                f"p99 {cold['p99'] * 1000:.2f}ms), answer_batch() {batch['per_second']:.0f}/s"
+            )
+            if not kg_results["snapshot"]["consistent"]:
+                print("  the streamed facts snapshot differs from the in-memory one!")
+        if args.build_sizes:
+            print(f"Benchmarking the builder on {args.build_kg} ..")
+            build = bench_build(args.build_kg, args.build_sizes, word_model, tmp)
+            results["results"]["build"] = build
+            for run in build.get("runs", {}).values():
+                print(f"  {run['facts']} facts: {run['seconds']:.2f}s")
+            if "skipped" in build:
+                print(f"  skipped: {build['skipped']}")
+
+    with open(args.output, "w") as out_file:
+        json.dump(results, out_file, indent=2)
+    print(f"Done. See output: {args.output}")
+    if args.baseline:
+        with open(args.baseline) as in_file:
+            baseline = json.load(in_file)
+        print(f"Compared to {args.baseline}:")
+        for line in compare(results, baseline):
+            print(f"  {line}")
+    return results
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("--kg", nargs="+", default=DEFAULT_KGS, help="KG csv files")
+    parser.add_argument("--n_questions", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=300, help="synthetic word vectors size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--build_sizes",
+        type=int,
+        nargs="*",
+        default=[1000, 10000, 100000],
+        help="facts of --build_kg to build the models from (none: skip the builder)",
+    )
+    parser.add_argument("--build_kg", default=DEFAULT_KGS[0])
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare to")
+    main(parser.parse_args())
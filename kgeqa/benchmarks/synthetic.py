@@ -0,0 +1,99 @@
+"""
+Offline fixtures of the benchmarks: a synthetic word model and the models built from a KG
+
+`SyntheticWordModel` stands in for the (downloaded) word model: each word's vector is the
+normalized sum of random vectors of its character trigrams, like a subword model, so
+misspelled or partial words still land close to the original ones.
+`write_models` writes what the builder would for a KG csv file (ENT/REL key indexes and
+matrices, the facts snapshot), and `register_models` points `load_models` at them.
+"""
+import os
+import zlib
+from typing import Dict, List, Union
+
+import numpy as np
+
+from .. import load_models as models
+from ..config import Tensor
+from ..similarity import char_ngrams
+
+
+class SyntheticWordModel:
+    """deterministic subword-like word vectors, queried like a `pymagnitude.Magnitude`"""
+
+    def __init__(self, dim: int = 300, n: int = 3):
+        self.dim = dim
+        self.n = n
+        self._grams: Dict[str, Tensor] = {}
+
+    def _gram(self, gram: str) -> Tensor:
+        vector = self._grams.get(gram)
+        if vector is None:
+            seed = zlib.crc32(gram.encode("utf-8"))
+            vector = np.random.RandomState(seed).standard_normal(self.dim).astype(np.float32)
+            self._grams[gram] = vector
+        return vector
+
+    def _word(self, word: str) -> Tensor:
+        vector = np.sum([self._gram(g) for g in char_ngrams(word, self.n)], axis=0)
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def query(self, words: Union[str, List[str]]) -> Tensor:
+        if isinstance(words, str):
+            return self._word(words)
+        if not len(words):
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self._word(w) for w in words])
+
+    def most_similar(self, word: str, topn: int = 10):
+        return []  # -- no vocabulary (used by the builder's --word_model only)
+
+    def __iter__(self):
+        return iter(())
+
+
+def write_models(kg_csv: str, out_dir: str, word_model: SyntheticWordModel) -> Dict[str, str]:
+    """writes the models of `kg_csv` to `out_dir` as the builder would
+    (without the .magnitude files, whose keys and matrices are all the answering needs)
+    and returns their paths
+    """
+    import shutil
+    from ..fact_store import FactStore, snapshot_path
+    from ..key_index import KeyIndex, sidecar_path
+    from ..kg_reader import distinct, read_kg
+    from ..neighbors import matrix_path, normalize
+
+    os.makedirs(out_dir, exist_ok=True)
+    df = read_kg(kg_csv, lower=())
+    paths = dict(
+        entities=os.path.join(out_dir, "ENT.vec.magnitude"),
+        relations=os.path.join(out_dir, "REL.vec.magnitude"),
+        kg=os.path.join(out_dir, "KG.csv"),
+    )
+    for name, columns in [("entities", ["h", "t"]), ("relations", ["r"])]:
+        tokens = distinct(df, columns).tolist()
+        KeyIndex.write(sidecar_path(paths[name]), tokens)
+        np.save(matrix_path(paths[name]), normalize(word_model.query(tokens)))
+    shutil.copyfile(kg_csv, paths["kg"])
+    FactStore.from_dataframe(df).save(snapshot_path(paths["kg"]))
+    return paths
+
+
+def register_models(paths: Dict[str, str], word_model: SyntheticWordModel) -> None:
+    """loads the models written by `write_models` (on first use, like the real ones)"""
+    models.register("WORD_VECTORS_MODEL", lambda: word_model)
+    models.register("EMBEDDING_MODEL", lambda: word_model)
+    models.register(
+        "ENTITY_VECTORS_KEYS",
+        lambda: models.load_model_keys("ENTITY_VECTORS_MODEL", paths["entities"]),
+    )
+    models.register(
+        "RELATION_VECTORS_KEYS",
+        lambda: models.load_model_keys("RELATION_VECTORS_MODEL", paths["relations"]),
+    )
+    models.register(
+        "NEIGHBOR_ENGINE",
+        lambda: models.build_neighbor_engine(paths["entities"], paths["relations"]),
+    )
+    models.register("KG_DATABASE", lambda: models.read_kg_data(paths["kg"]))
+    models.register("KG_FACTS", lambda: models.build_fact_store(paths["kg"]))
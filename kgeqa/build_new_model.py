@@ -10,16 +10,151 @@ Usage:
     from kge_qa.kgeqa.build_new_model import BuildKGModels
     BuildKGModels().run("<full-path-to-csv-file>")
 
+    # streaming mode, for csv files that don't fit in memory (reads 1M facts at a time)
+    $ python build_new_model.py -kg_dataset <FULL-PATH-TO-CSV-FILE> --chunksize 1000000
+
+    # embed the vocabularies with 4 processes (each opens its own word model)
+    $ python build_new_model.py -kg_dataset <FULL-PATH-TO-CSV-FILE> --workers 4
+
+    # also store the ENT/REL matrices as int8 (or float16), see NEIGHBORS_DTYPE in params.py
+    $ python build_new_model.py -kg_dataset <FULL-PATH-TO-CSV-FILE> --precision int8
+
+    # also build a small word model for the questions (data/WORDS.vec.magnitude)
+    $ python build_new_model.py -kg_dataset <FULL-PATH-TO-CSV-FILE> --word_model
+
+    # add the facts of a (small) delta csv file to the existing models
+    $ python build_new_model.py --append <FULL-PATH-TO-DELTA-CSV-FILE>
+
 INPUT:
     csv file contains knowledge graph dataset with three columns h,r,t
 OUTPUT:
    Two new embedding models, one for entities and one for relations
+   (MODEL.vec.magnitude, with its MODEL.vec.magnitude.npy matrix and .keys index),
+   and the facts snapshot data/KG.csv.facts/ (see kgeqa/fact_store.py)
 """
-from typing import List
+from typing import Iterable, Iterator, List, Tuple
+import os
+
 from pymagnitude import Magnitude
 
+import numpy as np
 import pandas as pd
 
+from .kg_reader import distinct, read_kg
+from .utils.files import atomic_write
+
+
+class VectorsWriter:
+    """writes the vectors of one model incrementally, as
+    - MODEL.vec.magnitude.npy: unit-normalized float32 matrix, rows in key order
+      (loaded as is by the neighbor engine)
+    - MODEL.vec: text vectors, the input of the .magnitude converter
+    Both headers (the row count) are written on `close()`
+    """
+
+    def __init__(self, out_file: str, dim: int, matrix: bool = True):
+        import tempfile
+
+        self.out_file = out_file  # MODEL.vec
+        self.dim = dim
+        self.count = 0
+        self._body = tempfile.TemporaryFile("w+")
+        self._matrix = tempfile.TemporaryFile("w+b") if matrix else None
+        self._keys = tempfile.TemporaryFile("w+")  # one key per line, in row order
+
+    def add(self, key: str, vector) -> None:
+        self.add_block([key], np.asarray(vector)[None, :])
+
+    def add_block(self, keys: List[str], vectors: np.ndarray) -> None:
+        """writes one line per (key, row of `vectors`), the rows formatted as a block"""
+        from .neighbors import normalize
+
+        row_format = " ".join(["%.9g"] * vectors.shape[1])  # float32 round-trips at 9 digits
+        lines = [f"{k} {row_format % tuple(v)}" for k, v in zip(keys, vectors.tolist())]
+        self._body.write("\n".join(lines) + "\n")
+        if self._matrix is not None:
+            self._matrix.write(normalize(vectors).astype("<f4").tobytes())
+        self._keys.write("\n".join(map(str, keys)) + "\n")
+        self.count += len(keys)
+
+    def close(self) -> None:
+        import shutil
+        from .neighbors import matrix_path
+
+        with open(self.out_file, "w") as out:
+            out.write(f"{self.count} {self.dim}\n")
+            self._body.seek(0)
+            shutil.copyfileobj(self._body, out)
+        self._body.close()
+        if self._matrix is None:
+            return
+
+        with atomic_write(matrix_path(f"{self.out_file}.magnitude")) as out:
+            header = dict(descr="<f4", fortran_order=False, shape=(self.count, self.dim))
+            np.lib.format.write_array_header_1_0(out, header)
+            self._matrix.seek(0)
+            shutil.copyfileobj(self._matrix, out)
+        self._matrix.close()
+
+    def keys(self) -> Iterator[str]:
+        """the written keys, in row order (read back from disk)"""
+        self._keys.seek(0)
+        return (line.rstrip("\n") for line in self._keys)
+
+
+def _process_pool(max_workers: int, **kwargs) -> "ProcessPoolExecutor":
+    """a pool of spawned (not forked) processes: a fork copies the parent's threads
+    (e.g. the logging listener) in a state they can't resume from
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers, mp_context=context, **kwargs)
+
+
+# -- each worker process of a parallel build opens its own (read-only) word model
+_WORKER_MODEL = None
+
+
+def _init_worker(word_model_path: str):
+    global _WORKER_MODEL
+    _WORKER_MODEL = Magnitude(path=word_model_path)
+
+
+def _embed_in_worker(word_tokens: List[str]) -> np.ndarray:
+    return np.asarray(_WORKER_MODEL.query(word_tokens))
+
+
+def _convert(vec_file: str, subword: bool = False) -> str:
+    """converts MODEL.vec to MODEL.vec.magnitude (in a worker process),
+    with `subword` n-grams for out-of-vocabulary keys
+    """
+    from pymagnitude import converter
+
+    out_file = f"{vec_file}.magnitude"
+    if os.path.exists(out_file):
+        os.remove(out_file)
+    converter.convert(vec_file, out_file, subword=subword)
+    return out_file
+
+
+def _remove_stale(path: str) -> None:
+    """removes `path`, a file of a former build that this build doesn't rewrite"""
+    if os.path.exists(path):
+        os.remove(path)
+        print(f"Removed the outdated {path}")
+
+
+def _new_keys(values: np.ndarray, seen: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """the unique `values` whose 64-bit hash is not in the sorted array `seen`,
+    and the updated `seen` (8 bytes per distinct key, whatever the number of facts)
+    """
+    values = pd.unique(values)
+    hashes = pd.util.hash_array(values)
+    new = ~np.isin(hashes, seen)
+    return values[new], np.union1d(seen, hashes[new])
+
 
 class BuildKGModels:
     vector_model: Magnitude
@@ -28,61 +163,476 @@ class BuildKGModels:
     relations: List[str]
     ENT_VEC_OUTPUT: str = "data/ENT.vec"
     REL_VEC_OUTPUT: str = "data/REL.vec"
+    WORD_VEC_OUTPUT: str = "data/WORDS.vec"
+    KG_OUTPUT: str = "data/KG.csv"
+    N_FREQUENT_WORDS: int = 50000  # most frequent words kept in the trimmed word model
+    N_WORD_NEIGHBORS: int = 10  # closest words kept for each relation word
+    BATCH_SIZE: int = 1024  # tokens embedded per Magnitude.query() call
+    BATCHES_PER_WORKER: int = 2  # batches queued or embedded per worker process at a time
 
-    def __init__(self):
-        from .load_models import EMBEDDING_MODEL
+    def __init__(
+        self,
+        ann: bool = False,
+        keep_vec: bool = False,
+        workers: int = 1,
+        precision: str = "float32",
+        word_model: bool = False,
+    ):
+        from .load_models import WORD_VECTORS_MODEL
 
-        self.vector_model = EMBEDDING_MODEL
+        self.vector_model = WORD_VECTORS_MODEL
+        self.ann = ann  # also build an approximate nearest-neighbor index of ENT
+        self.keep_vec = keep_vec  # keep the intermediate text MODEL.vec (for debugging)
+        self.workers = workers  # processes embedding the vocabularies
+        self.precision = precision  # also store the matrices as "float16" or "int8"
+        self.word_model = word_model  # also build the trimmed word model of the questions
+        self._pool = None
 
-    def run(self, csv_file):
+    def run(self, csv_file, chunksize: int = 0):
+        """builds the models from `csv_file`, streaming it `chunksize` facts at a time if set"""
         self.csv_file = csv_file
-        self.entities, self.relations = self.read_kg_data(self.csv_file)
-        self.build_vectors_file(self.entities, self.ENT_VEC_OUTPUT)
-        self.build_vectors_file(self.relations, self.REL_VEC_OUTPUT)
+        try:
+            self._start_workers()
+            self._build(chunksize)
+        finally:
+            self._stop_workers()
+
+    def _build(self, chunksize: int):
+        if chunksize:
+            entity_keys, relation_keys = self.build_vectors_streaming(
+                self.csv_file, chunksize
+            )
+        else:
+            self.entities, self.relations = self.read_kg_data(self.csv_file)
+            self.build_vectors_file(self.entities, self.ENT_VEC_OUTPUT)
+            self.build_vectors_file(self.relations, self.REL_VEC_OUTPUT)
+            entity_keys, relation_keys = self.entities, self.relations
         self._convert_to_magnitude_format()
+        self._copy_kg_data()
+        self._write_kg_snapshot(chunksize)
+        self._write_key_indexes(entity_keys, relation_keys)
+        if self.ann:
+            self._build_ann_index()
+        else:
+            self._remove_stale_ann_indexes()
+        for vec_file in (self.ENT_VEC_OUTPUT, self.REL_VEC_OUTPUT):
+            self._write_reduced_matrices(f"{vec_file}.magnitude")
+        # -- a former trimmed word model (preferred to embed questions) lacks the new keys
+        if self.word_model or os.path.exists(f"{self.WORD_VEC_OUTPUT}.magnitude"):
+            self.build_word_model()
+        self._reload_models()
+
+    def append(self, delta_csv_file: str):
+        """adds the facts of `delta_csv_file` to the already built models:
+        only its new entities/relations are embedded, and appended to the ENT/REL
+        matrices, key indexes and ANN index (if any). The .magnitude models are
+        regenerated from the matrices, and the facts are appended to the KG dataset
+        """
+        self.csv_file = delta_csv_file
+        try:
+            self._start_workers()
+            self._append()
+        finally:
+            self._stop_workers()
+
+    def _append(self):
+        print(f"Started a model update for data from: {self.csv_file}")
+        self._check_appendable()
+        df = read_kg(self.csv_file, lower=())
+        self._append_vectors(distinct(df, ["h", "t"]), self.ENT_VEC_OUTPUT)
+        self._append_vectors(distinct(df, ["r"]), self.REL_VEC_OUTPUT)
+        self._convert_to_magnitude_format()
+        if self.word_model or os.path.exists(f"{self.WORD_VEC_OUTPUT}.magnitude"):
+            self.build_word_model()
+        self._append_kg_data(df)
+
+    def _check_appendable(self):
+        """fails before updating anything if the models lack the key index or matrix
+        (built by an older version), which the update reads instead of the models
+        """
+        from .key_index import sidecar_path
+        from .neighbors import matrix_path
+
+        for vec_file in (self.ENT_VEC_OUTPUT, self.REL_VEC_OUTPUT):
+            model_file = f"{vec_file}.magnitude"
+            for path in (sidecar_path(model_file), matrix_path(model_file)):
+                if not os.path.exists(path):
+                    raise FileNotFoundError(
+                        f"{path} not found: {model_file} was built by an older version, "
+                        f"run a full rebuild (without --append) first"
+                    )
+
+    def _append_vectors(self, word_tokens: Iterable[str], out_file: str):
+        """rewrites MODEL.vec (and its matrix, keys, ANN index) with the tokens not in it yet,
+        the existing keys as they were built (from the MODEL.vec.magnitude.names sidecar)
+        """
+        from .ann import IVFIndex, ann_index_path
+        from .key_index import KeyIndex, names_path, sidecar_path
+        from .neighbors import matrix_path, normalize
+
+        model_file = f"{out_file}.magnitude"
+        keys = KeyIndex(sidecar_path(model_file))
+        if os.path.exists(names_path(model_file)):
+            names = KeyIndex(names_path(model_file))
+        else:  # -- built before the names were written: the keys as stored in the model
+            print(f"No {names_path(model_file)}, reading the keys of {model_file} ..")
+            names = [key for key, _ in Magnitude(model_file)]
+        new_tokens = {}  # lower cased -> token, as the keys are
+        for token in word_tokens:
+            if str(token).lower() not in keys:
+                new_tokens.setdefault(str(token).lower(), token)
+        new_tokens = list(new_tokens.values())
+        print(f"Adding {len(new_tokens)} new tokens to {model_file} ({len(keys)} tokens) ..")
+
+        # -- the existing rows are copied from the matrix, without re-embedding them
+        writer = VectorsWriter(out_file, self.vector_model.dim)
+        matrix = np.load(matrix_path(model_file), mmap_mode="r")
+        for start in range(0, len(keys), self.BATCH_SIZE):
+            rows = range(start, min(start + self.BATCH_SIZE, len(keys)))
+            writer.add_block([names[i] for i in rows], np.asarray(matrix[start : rows.stop]))
+        del matrix
+        self._write_vectors(writer, new_tokens)
+        writer.close()
+        n_keys = KeyIndex.write(sidecar_path(model_file), writer.keys())
+        KeyIndex.write(names_path(model_file), writer.keys(), lower=False)
+        print(f"Done ({n_keys} tokens). See output: {out_file}")
+        self._write_reduced_matrices(model_file)
+
+        ann_file = ann_index_path(model_file)
+        if os.path.exists(ann_file) and new_tokens:
+            index = IVFIndex.load(ann_file)
+            matrix = np.load(matrix_path(model_file), mmap_mode="r")
+            index.add(normalize(matrix[len(keys) :]))
+            index.save(ann_file)
+            print(f"Done. See output: {ann_file}")
+
+    def _append_kg_data(self, df: pd.DataFrame):
+        """appends the facts of `df` to the KG dataset and its snapshot"""
+        from .fact_store import FactStore, snapshot_path
+
+        with open(self.KG_OUTPUT, "rb+") as kg_file:
+            kg_file.seek(-1, os.SEEK_END)
+            if kg_file.read(1) != b"\n":
+                kg_file.write(b"\n")
+        df.to_csv(self.KG_OUTPUT, mode="a", header=False, index=False)
+        print(f"Done ({len(df)} facts). See output: {self.KG_OUTPUT}")
+
+        out_dir = snapshot_path(self.KG_OUTPUT)
+        if os.path.isdir(out_dir):
+            FactStore.load(out_dir).extend(df).save(out_dir)
+            print(f"Done. See output: {out_dir}")
+        else:
+            self._write_kg_snapshot()
+        self._reload_models()
 
     @staticmethod
     def read_kg_data(csv_file):
         """reads csv as dataframe and returns entities and relations"""
         print(f"Started a model builder for data from: {csv_file}")
-        df = pd.read_csv(csv_file)
-        df.columns = ["h", "r", "t"]
-        entities = list(set(df["h"].tolist() + df["t"].tolist()))
-        relations = list(set(df["r"].tolist()))
+        df = read_kg(csv_file, lower=())
+        entities = distinct(df, ["h", "t"]).tolist()
+        relations = distinct(df, ["r"]).tolist()
         return entities, relations
 
     def build_vectors_file(self, word_tokens: List[str], out_file: str):
-        """builds MODEL.vec"""
+        """builds MODEL.vec (and MODEL.vec.magnitude.npy)"""
         print(f"Building a new embedding model for {len(word_tokens)} tokens ..")
-        with open(out_file, "w") as out:
-            out.write(f"{len(word_tokens)} {self.vector_model.dim}\n")
-            for e in word_tokens:
-                v = self.vector_model.query(e)  # Magnitude.query()
-                str_vec = " ".join(map(str, v))  # ndarray to str
-                line = f"{e} {str_vec}\n"
-                out.write(line)
+        writer = VectorsWriter(out_file, self.vector_model.dim)
+        self._write_vectors(writer, word_tokens)
+        writer.close()
         print(f"Done. See output: {out_file}")
 
-    def _convert_to_magnitude_format(self):
-        """converts MODEL.vec to MODEL.vec.magnitude"""
-        import os
+    def _start_workers(self):
+        """with `workers > 1`, a process pool where each worker opens its own word model"""
+        if self.workers > 1:
+            from .params import WORD_VECTORS_MODEL_LOCATION
+
+            path = getattr(self.vector_model, "path", WORD_VECTORS_MODEL_LOCATION)
+            self._pool = _process_pool(self.workers, initializer=_init_worker, initargs=(path,))
+
+    def _stop_workers(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
 
+    def _embed_batches(
+        self, word_tokens: List[str]
+    ) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """(batch, vectors) for each batch of `BATCH_SIZE` tokens, in order,
+        the batches are sharded over the worker processes, if any (see `_embed_in_pool`)
+        """
+        batches = [
+            list(word_tokens[i : i + self.BATCH_SIZE])
+            for i in range(0, len(word_tokens), self.BATCH_SIZE)
+        ]
+        if self._pool is not None:
+            return self._embed_in_pool(batches)
+        return ((b, np.asarray(self.vector_model.query(b))) for b in batches)
+
+    def _embed_in_pool(
+        self, batches: List[List[str]]
+    ) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """(batch, vectors) for each of `batches`, in order (i.e. deterministic), with at most
+        `BATCHES_PER_WORKER` batches per worker in flight: when the workers are faster than
+        the caller writing the vectors, the finished ones don't pile up in memory
+        """
+        from collections import deque
+
+        pending = deque()
+        for batch in batches:
+            if len(pending) >= self.BATCHES_PER_WORKER * self.workers:
+                done, future = pending.popleft()
+                yield done, future.result()
+            pending.append((batch, self._pool.submit(_embed_in_worker, batch)))
+        while pending:
+            done, future = pending.popleft()
+            yield done, future.result()
+
+    def embed(self, word_tokens: List[str]) -> np.ndarray:
+        """one row per token, queried from the word model in batches of `BATCH_SIZE`"""
+        blocks = [vectors for _, vectors in self._embed_batches(word_tokens)]
+        if not blocks:
+            return np.zeros((0, self.vector_model.dim), dtype=np.float32)
+        return np.concatenate(blocks)
+
+    def _write_vectors(self, writer: VectorsWriter, word_tokens: Iterable[str]):
+        import time
+
+        word_tokens = list(word_tokens)
+        start = time.perf_counter()
+        done = 0
+        for i, (batch, vectors) in enumerate(self._embed_batches(word_tokens)):
+            writer.add_block(batch, vectors)
+            done += len(batch)
+            if done == len(word_tokens) or i % 10 == 9:
+                rate = done / max(time.perf_counter() - start, 1e-9)
+                print(f".. {done}/{len(word_tokens)} tokens ({rate:.0f} tokens/sec)")
+
+    def build_vectors_streaming(
+        self, csv_file: str, chunksize: int
+    ) -> Tuple[Iterator[str], Iterator[str]]:
+        """builds ENT.vec and REL.vec reading `csv_file` in chunks of `chunksize` facts:
+        new entities/relations of each chunk are embedded and written right away,
+        only the 64-bit hashes of the already seen ones are kept in memory.
+        Returns the entity and relation keys (in row order)
+        """
+        print(f"Started a streaming model builder for data from: {csv_file}")
+        entities = VectorsWriter(self.ENT_VEC_OUTPUT, self.vector_model.dim)
+        relations = VectorsWriter(self.REL_VEC_OUTPUT, self.vector_model.dim)
+        seen_entities = seen_relations = np.zeros(0, dtype=np.uint64)
+        for i, df in enumerate(read_kg(csv_file, lower=(), chunksize=chunksize)):
+            new_entities, seen_entities = _new_keys(distinct(df, ["h", "t"]), seen_entities)
+            new_relations, seen_relations = _new_keys(distinct(df, ["r"]), seen_relations)
+            self._write_vectors(entities, new_entities)
+            self._write_vectors(relations, new_relations)
+            print(
+                f".. chunk {i}: {len(df)} facts, "
+                f"{entities.count} entities, {relations.count} relations so far"
+            )
+        for writer in (entities, relations):
+            writer.close()
+            print(f"Done. See output: {writer.out_file}")
+        return entities.keys(), relations.keys()
+
+    def _convert_to_magnitude_format(self):
+        """converts MODEL.vec to MODEL.vec.magnitude, ENT and REL concurrently"""
         print(f"Converting models to .magnitude format ..")
-        cmd1 = f"python -m pymagnitude.converter -i {self.ENT_VEC_OUTPUT} -o {self.ENT_VEC_OUTPUT}.magnitude"
-        cmd2 = f"python -m pymagnitude.converter -i {self.REL_VEC_OUTPUT} -o {self.REL_VEC_OUTPUT}.magnitude"
-        os.system(cmd1)
-        os.system(cmd2)
-        print(f"Done")
+        vec_files = [self.ENT_VEC_OUTPUT, self.REL_VEC_OUTPUT]
+        with _process_pool(len(vec_files)) as pool:
+            for out_file in pool.map(_convert, vec_files):
+                print(f"Done. See output: {out_file}")
+        if not self.keep_vec:
+            for vec_file in vec_files:
+                os.remove(vec_file)
+
+    def _copy_kg_data(self):
+        """override the previous default dataset"""
+        import shutil
+
+        kg_file = self.KG_OUTPUT
+        if not (os.path.exists(kg_file) and os.path.samefile(self.csv_file, kg_file)):
+            shutil.copyfile(self.csv_file, kg_file)
+
+    def build_word_model(self):
+        """builds WORDS.vec.magnitude, the word model trimmed to what questions about the KG need:
+        the `N_FREQUENT_WORDS` most frequent words (first keys) of the full model, the ENT/REL
+        keys and their words, and the `N_WORD_NEIGHBORS` closest words of each relation word.
+        It's converted with subword n-grams, so unknown words still get a (subword) vector
+        """
+        from itertools import islice
+        from .key_index import KeyIndex, sidecar_path
+
+        print(f"Building a trimmed word model ..")
+        words = dict.fromkeys(key for key, _ in islice(self.vector_model, self.N_FREQUENT_WORDS))
+        relation_words = {}
+        for vec_file, kg_words in [
+            (self.ENT_VEC_OUTPUT, {}),
+            (self.REL_VEC_OUTPUT, relation_words),
+        ]:
+            for key in KeyIndex(sidecar_path(f"{vec_file}.magnitude")):
+                words[key] = None
+                kg_words.update(dict.fromkeys(w for w in key.split("_") if w))
+            words.update(kg_words)
+        for word in relation_words:
+            for neighbor, _ in self.vector_model.most_similar(word, topn=self.N_WORD_NEIGHBORS):
+                words[neighbor] = None
+
+        writer = VectorsWriter(self.WORD_VEC_OUTPUT, self.vector_model.dim, matrix=False)
+        self._write_vectors(writer, list(words))
+        writer.close()
+        out_file = _convert(self.WORD_VEC_OUTPUT, subword=True)
+        if not self.keep_vec:
+            os.remove(self.WORD_VEC_OUTPUT)
+        print(f"Done ({writer.count} words). See output: {out_file}")
+
+    def _write_kg_snapshot(self, chunksize: int = 0):
+        """writes the columnar facts snapshot of the KG dataset (see `kgeqa.fact_store`),
+        sorted on disk `chunksize` facts at a time if set
+        """
+        from .fact_store import FactStore, snapshot_path
+
+        dfs = read_kg(self.KG_OUTPUT, lower=(), chunksize=chunksize)
+        out_dir = snapshot_path(self.KG_OUTPUT)
+        if chunksize:
+            facts = FactStore.write_snapshot(dfs, out_dir, block_size=chunksize)
+        else:
+            facts = FactStore.from_dataframe(dfs)
+            facts.save(out_dir)
+        print(f"Done ({len(facts)} facts). See output: {out_dir}")
+
+    def _write_key_indexes(self, entity_keys: Iterable[str], relation_keys: Iterable[str]):
+        """writes the lower cased keys sidecar next to each MODEL.vec.magnitude,
+        and its keys as they are (read back by `--append`)
+        """
+        from .key_index import KeyIndex, names_path, sidecar_path
+
+        for keys, vec_file in [
+            (entity_keys, self.ENT_VEC_OUTPUT),
+            (relation_keys, self.REL_VEC_OUTPUT),
+        ]:
+            keys = list(keys)
+            out_file = sidecar_path(f"{vec_file}.magnitude")
+            KeyIndex.write(out_file, keys)
+            KeyIndex.write(names_path(f"{vec_file}.magnitude"), keys, lower=False)
+            print(f"Done. See output: {out_file}")
+
+    def _write_reduced_matrices(self, model_file: str):
+        """writes the reduced matrix of `self.precision`, if any, and removes the others
+        (of a former build, they would no longer match the keys)
+        """
+        from .neighbors import matrix_path
+        from .quantize import scales_path
+
+        for precision in ("float16", "int8"):
+            if precision == self.precision:
+                self._write_reduced_matrix(model_file, precision)
+                continue
+            _remove_stale(matrix_path(model_file, precision))
+            if precision == "int8":
+                _remove_stale(scales_path(matrix_path(model_file, precision)))
+
+    def _write_reduced_matrix(self, model_file: str, precision: str):
+        """writes MODEL.vec.magnitude.<precision>.npy, the matrix stored as float16 or
+        int8 codes (see `kgeqa.quantize`), and checks its search recall against float32
+        """
+        from .neighbors import matrix_path, VectorTable
+        from .quantize import QuantizedMatrix
+
+        matrix = np.load(matrix_path(model_file), mmap_mode="r")
+        if precision == "int8":
+            reduced = QuantizedMatrix.quantize(matrix)
+            reduced.save(matrix_path(model_file, precision))
+        else:
+            reduced = np.asarray(matrix, dtype=precision)
+            with atomic_write(matrix_path(model_file, precision)) as out:
+                np.save(out, reduced)
+        recall = self.recall_at_k(
+            VectorTable(None, matrix, "", normalized=True),
+            VectorTable(None, reduced, "", precision, normalized=True),
+            matrix,
+        )
+        print(
+            f"Done (recall@10 vs float32: {recall:.3f}). "
+            f"See output: {matrix_path(model_file, precision)}"
+        )
+
+    @staticmethod
+    def recall_at_k(
+        exact, approx, matrix: np.ndarray, k: int = 10, n_queries: int = 1000, seed: int = 0
+    ) -> float:
+        """fraction of the exact top-`k` neighbors of (up to `n_queries`) rows of `matrix`
+        that `approx` finds as well, both `VectorTable`s
+        """
+        rng = np.random.RandomState(seed)
+        rows = rng.choice(len(matrix), min(n_queries, len(matrix)), replace=False)
+        queries = np.asarray(matrix[np.sort(rows)], dtype=np.float32)
+        if not len(queries):
+            return 1.0
+        exact_ids, _ = exact.top_k(queries, k)
+        approx_ids, _ = approx.top_k(queries, k)
+        hits = [len(set(e) & set(a)) for e, a in zip(exact_ids.tolist(), approx_ids.tolist())]
+        return sum(hits) / exact_ids.size
+
+    @staticmethod
+    def _reload_models():
+        """drop the already loaded ENT/REL/KG resources (and the caches keyed by them)"""
+        from . import load_models
+
+        load_models.reset(
+            "EMBEDDING_MODEL",
+            "ENTITY_VECTORS_MODEL",
+            "ENTITY_VECTORS_KEYS",
+            "RELATION_VECTORS_MODEL",
+            "RELATION_VECTORS_KEYS",
+            "NEIGHBOR_ENGINE",
+            "KG_DATABASE",
+            "KG_FACTS",
+        )
+
+    def _remove_stale_ann_indexes(self):
+        """removes the ANN indexes of a former `--ann` build (they index the old matrices)"""
+        from .ann import ann_index_path
+
+        for vec_file in (self.ENT_VEC_OUTPUT, self.REL_VEC_OUTPUT):
+            _remove_stale(ann_index_path(f"{vec_file}.magnitude"))
+
+    def _build_ann_index(self):
+        """builds the IVF index of ENT.vec.magnitude (see `kgeqa.ann`)"""
+        from .ann import IVFIndex, ann_index_path
+
+        from .neighbors import matrix_path
 
-        # -- override the previous default dataset
-        cmd1 = f"cp {self.csv_file} data/KG.csv"
-        os.system(cmd1)
+        model_file = f"{self.ENT_VEC_OUTPUT}.magnitude"
+        print(f"Building ANN index for {model_file} ..")
+        matrix = np.load(matrix_path(model_file), mmap_mode="r")
+        index = IVFIndex.build(matrix)
+        out_file = ann_index_path(model_file)
+        index.save(out_file)
+        print(f"Done ({index.n_lists} lists). See output: {out_file}")
 
 
-def main(input_file):
-    """create ENT.vec and REL.vec models from `input_file`"""
-    builder = BuildKGModels()
-    builder.run(input_file)
+def main(
+    input_file,
+    ann=False,
+    chunksize=0,
+    keep_vec=False,
+    workers=1,
+    append=None,
+    precision="float32",
+    word_model=False,
+):
+    """create ENT.vec and REL.vec models from `input_file` (or update them from `append`)"""
+    builder = BuildKGModels(
+        ann=ann,
+        keep_vec=keep_vec,
+        workers=workers,
+        precision=precision,
+        word_model=word_model,
+    )
+    if append:
+        builder.append(append)
+    else:
+        builder.run(input_file, chunksize=chunksize)
 
 
 if __name__ == "__main__":
@@ -90,7 +640,47 @@ if __name__ == "__main__":
 
     parser = ArgumentParser()
     parser.add_argument("-csv", "--kg_dataset", default="data/KG.csv")
+    parser.add_argument(
+        "--ann", action="store_true", help="build an ANN index for large ENT models"
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=0,
+        help="stream the csv file this many facts at a time (bounded memory)",
+    )
+    parser.add_argument(
+        "--keep_vec", action="store_true", help="keep the text ENT.vec/REL.vec files"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="processes embedding the vocabularies"
+    )
+    parser.add_argument(
+        "--precision",
+        choices=["float32", "float16", "int8"],
+        default="float32",
+        help="also store the ENT/REL matrices in this (reduced) precision",
+    )
+    parser.add_argument(
+        "--word_model",
+        action="store_true",
+        help="also build a word model trimmed to the KG vocabulary for the questions",
+    )
+    parser.add_argument(
+        "--append",
+        default=None,
+        help="csv file of new facts to add to the existing models (no full rebuild)",
+    )
     args = parser.parse_args()
     csv_file_path = args.kg_dataset
 
-    main(csv_file_path)
+    main(
+        csv_file_path,
+        ann=args.ann,
+        chunksize=args.chunksize,
+        keep_vec=args.keep_vec,
+        workers=args.workers,
+        append=args.append,
+        precision=args.precision,
+        word_model=args.word_model,
+    )
@@ -0,0 +1,152 @@
+"""
+Bounded caches with hit/miss counters, safe to share between threads
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+_MISSING = object()
+
+
+class LRUCache:
+    """least-recently-used cache holding at most `maxsize` entries"""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                size=len(self._data),
+                maxsize=self.maxsize,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_rate=self.hits / lookups if lookups else 0.0,
+            )
+
+
+class PersistentLRUCache(LRUCache):
+    """LRU cache of JSON-serializable values with string keys,
+    optionally backed by an SQLite file (`path`) so entries survive restarts.
+    The file holds at most `maxsize` entries too (least recently stored are evicted)
+    """
+
+    def __init__(self, maxsize: int = 10000, path: str = None):
+        super().__init__(maxsize)
+        self.path = path
+        self.disk_hits = 0
+        self.disk_evictions = 0
+        self._disk_size = 0  # -- entries in the file, counted once then kept up to date
+        self._db = None
+        if path:
+            import sqlite3
+
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            # -- a commit per stored answer: appended to the WAL, without syncing each one
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._db.commit()
+            (self._disk_size,) = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:  # -- one SQLite connection, shared by the threads
+            value = super().get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self.misses -= 1  # counted as a (disk) hit instead
+                    self.hits += 1
+                    self.disk_hits += 1
+                    super().put(key, value)
+                    return value
+            return default
+
+    def __contains__(self, key: str) -> bool:
+        """whether `key` is in memory or in the file (not counted as a lookup)"""
+        with self._lock:
+            if super().__contains__(key):
+                return True
+            if self._db is None:
+                return False
+            row = self._db.execute("SELECT 1 FROM cache WHERE key = ?", (key,)).fetchone()
+            return row is not None
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            super().put(key, value)
+            if self._db is None:
+                return
+            # -- re-inserting moves the key to the end of the rowid order
+            if not self._db.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount:
+                self._disk_size += 1
+            self._db.execute(
+                "INSERT INTO cache (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+            if self._disk_size > self.maxsize:
+                evicted = self._db.execute(
+                    "DELETE FROM cache WHERE rowid IN "
+                    "(SELECT rowid FROM cache ORDER BY rowid LIMIT ?)",
+                    (self._disk_size - self.maxsize,),
+                ).rowcount
+                self.disk_evictions += evicted
+                self._disk_size -= evicted
+            self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            super().clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+                self._disk_size = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = super().stats()
+            stats.update(disk_hits=self.disk_hits, disk_evictions=self.disk_evictions)
+            return stats
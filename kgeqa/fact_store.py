@@ -0,0 +1,327 @@
+"""
+Columnar store of the KG facts (h, r, t)
+
+Heads/tails share one entity string table and relations have their own,
+so every fact is three int32 codes. The facts are sorted by their (head, relation)
+pair, encoded as one int64 `h * n_relations + r`, so `h->r->?` is a binary search
+over the unique pairs (`searchsorted`) and a slice of the tails column (CSR layout).
+
+A store is saved by the builder as a snapshot directory next to the csv file
+(e.g. `data/KG.csv.facts/`), which is memory-mapped on load:
+    entities.keys, relations.keys      string tables (`kgeqa.key_index` files)
+    heads.npy, relations.npy, tails.npy  int32 codes of the facts, sorted by pair
+    pairs.npy                          int64 unique pairs, sorted
+    offsets.npy                        int64 start of each pair's facts
+
+`FactStore.from_dataframes` builds a store in memory (12 bytes per fact, plus the sort);
+`FactStore.write_snapshot` writes the snapshot of csv chunks in the memory of one chunk
+(plus the string tables), spilling the codes to disk and sorting them there.
+"""
+import os
+from contextlib import ExitStack
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .config import Tensor
+from .kg_reader import lower
+from .utils.files import atomic_write
+
+SNAPSHOT_SUFFIX = ".facts"
+
+_COLUMNS = ["heads", "relations", "tails", "pairs", "offsets"]
+
+
+def snapshot_path(kg_path: str) -> str:
+    """e.g. data/KG.csv -> data/KG.csv.facts"""
+    return f"{kg_path}{SNAPSHOT_SUFFIX}"
+
+
+class StringTable:
+    """in-memory string table, looked up like a `KeyIndex`"""
+
+    names: List[str]
+    ids: Dict[str, int]
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.names = list(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+
+    def add(self, name: str) -> int:
+        """returns the id of `name`, added at the end if new"""
+        idx = self.ids.get(name)
+        if idx is None:
+            idx = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return idx
+
+    def encode(self, values: pd.Series) -> Tensor:
+        """int32 ids of `values` (one dict lookup per distinct value), which can't be missing"""
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, uniques = values.cat.codes.values, values.cat.categories
+        else:
+            codes, uniques = pd.factorize(np.asarray(values))
+        if (codes < 0).any():
+            raise ValueError(f"{int((codes < 0).sum())} missing values in column {values.name}")
+        ids = np.array([self.add(str(name)) for name in uniques], dtype=np.int32)
+        return ids[codes]
+
+    def row(self, name: str):
+        return self.ids.get(name)
+
+    def __getitem__(self, idx: int) -> str:
+        return self.names[idx]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+
+class FactStore:
+    entities: Sequence[str]  # StringTable, or KeyIndex when loaded from a snapshot
+    relations: Sequence[str]
+    heads: Tensor  # int32 codes, the facts sorted by pair
+    relation_codes: Tensor
+    tail_codes: Tensor
+    pairs: Tensor  # int64 unique `head * len(relations) + relation`, sorted
+    offsets: Tensor  # int64 (len(pairs) + 1,) start of each pair's facts
+
+    def __init__(
+        self,
+        entities: Sequence[str],
+        relations: Sequence[str],
+        heads: Tensor,
+        relation_codes: Tensor,
+        tail_codes: Tensor,
+        pairs: Tensor,
+        offsets: Tensor,
+    ):
+        self.entities = entities
+        self.relations = relations
+        self.heads = heads
+        self.relation_codes = relation_codes
+        self.tail_codes = tail_codes
+        self.pairs = pairs
+        self.offsets = offsets
+
+    @classmethod
+    def from_codes(
+        cls,
+        entities: Sequence[str],
+        relations: Sequence[str],
+        heads: Tensor,
+        relation_codes: Tensor,
+        tail_codes: Tensor,
+    ) -> "FactStore":
+        """sorts the facts by pair (stable, so each pair keeps its tails in input order)"""
+        keys = np.asarray(heads, dtype=np.int64) * max(len(relations), 1) + relation_codes
+        order = np.argsort(keys, kind="stable")
+        pairs, starts = np.unique(keys[order], return_index=True)
+        offsets = np.append(starts, len(keys)).astype(np.int64)
+        return cls(
+            entities,
+            relations,
+            np.asarray(heads, dtype=np.int32)[order],
+            np.asarray(relation_codes, dtype=np.int32)[order],
+            np.asarray(tail_codes, dtype=np.int32)[order],
+            pairs,
+            offsets,
+        )
+
+    @classmethod
+    def from_dataframes(
+        cls, dfs: Iterable[pd.DataFrame], base: "FactStore" = None
+    ) -> "FactStore":
+        """build the store from KG DataFrames with the columns h,r,t (e.g. csv chunks),
+        appended to the facts of `base` if given. Keys are lower cased.
+        All the codes are held in memory, see `write_snapshot` for larger KGs
+        """
+        entities = StringTable(base.entities if base is not None else ())
+        relations = StringTable(base.relations if base is not None else ())
+        columns = [[], [], []]
+        if base is not None:
+            columns = [[base.heads], [base.relation_codes], [base.tail_codes]]
+        for df in dfs:
+            for codes, table, col in zip(columns, [entities, relations, entities], "hrt"):
+                codes.append(table.encode(lower(df[col])))
+        heads, relation_codes, tail_codes = [
+            np.concatenate(codes) if codes else np.zeros(0, dtype=np.int32)
+            for codes in columns
+        ]
+        return cls.from_codes(entities, relations, heads, relation_codes, tail_codes)
+
+    @classmethod
+    def write_snapshot(
+        cls, dfs: Iterable[pd.DataFrame], path: str, block_size: int = 1 << 20
+    ) -> "FactStore":
+        """writes the snapshot of KG DataFrames (e.g. csv chunks) to `path`, as
+        `from_dataframes(dfs).save(path)` would, and returns it memory-mapped.
+        Only the string tables and about `block_size` facts are held in memory: the codes
+        are spilled to disk, then sorted by pair in the memory-mapped snapshot files
+        (a counting sort on the heads, then each block of whole heads by relation)
+        """
+        from .key_index import KeyIndex
+
+        os.makedirs(path, exist_ok=True)
+        entities, relations = StringTable(), StringTable()
+        spilled = [os.path.join(path, f"{name}.tmp.raw") for name in _COLUMNS]
+        head_counts = np.zeros(0, dtype=np.int64)
+        n = 0
+        with ExitStack() as stack:
+            files = [stack.enter_context(open(f, "wb")) for f in spilled[:3]]
+            for df in dfs:
+                for out, table, col in zip(files, [entities, relations, entities], "hrt"):
+                    codes = table.encode(lower(df[col]))
+                    out.write(codes.astype("<i4").tobytes())
+                    if col == "h":
+                        counts = np.bincount(codes, minlength=len(entities))
+                        counts[: len(head_counts)] += head_counts
+                        head_counts = counts
+                n += len(df)
+        if not n:
+            for f in spilled[:3]:
+                os.remove(f)
+            facts = cls.from_codes(entities, relations, *[np.zeros(0, dtype=np.int32)] * 3)
+            facts.save(path)
+            return cls.load(path)
+
+        # -- facts sorted by head (stable): each block's facts scattered after their head's
+        codes = [np.memmap(f, dtype="<i4", mode="r", shape=(n,)) for f in spilled[:3]]
+        columns = [
+            np.lib.format.open_memmap(
+                os.path.join(path, f"{name}.npy.tmp"), mode="w+", dtype=np.int32, shape=(n,)
+            )
+            for name in _COLUMNS[:3]
+        ]
+        head_bounds = np.append(0, np.cumsum(head_counts))
+        cursor = head_bounds[:-1].copy()
+        for start in range(0, n, block_size):
+            heads = np.asarray(codes[0][start : start + block_size])
+            order = np.argsort(heads, kind="stable")
+            sorted_heads = heads[order]
+            rank = np.arange(len(heads)) - np.searchsorted(sorted_heads, sorted_heads)
+            positions = cursor[sorted_heads] + rank
+            for column, block in zip(columns, codes):
+                column[positions] = np.asarray(block[start : start + block_size])[order]
+            cursor += np.bincount(heads, minlength=len(cursor))
+        del codes
+        for f in spilled[:3]:
+            os.remove(f)
+
+        # -- then blocks of whole heads sorted by relation (stable), with their pairs
+        n_pairs = 0
+        with open(spilled[3], "wb") as pairs_out, open(spilled[4], "wb") as offsets_out:
+            start = 0
+            while start < n:
+                i = np.searchsorted(head_bounds, start + block_size, side="right") - 1
+                end = int(head_bounds[i])
+                if end <= start:  # -- a head of more than `block_size` facts
+                    end = int(head_bounds[np.searchsorted(head_bounds, start, side="right")])
+                keys = np.asarray(columns[0][start:end], dtype=np.int64)
+                keys = keys * max(len(relations), 1) + columns[1][start:end]
+                order = np.argsort(keys, kind="stable")
+                for column in columns:
+                    column[start:end] = np.asarray(column[start:end])[order]
+                pairs, starts = np.unique(keys[order], return_index=True)
+                pairs_out.write(pairs.astype("<i8").tobytes())
+                offsets_out.write((starts + start).astype("<i8").tobytes())
+                n_pairs += len(pairs)
+                start = end
+            offsets_out.write(np.array([n], dtype="<i8").tobytes())
+
+        for column in columns:
+            column.flush()
+        del columns, column
+        for name, n_rows in [("pairs", n_pairs), ("offsets", n_pairs + 1)]:
+            raw_file = os.path.join(path, f"{name}.tmp.raw")
+            out_file = os.path.join(path, f"{name}.npy")
+            raw = np.memmap(raw_file, dtype="<i8", mode="r", shape=(n_rows,))
+            out = np.lib.format.open_memmap(
+                f"{out_file}.tmp", mode="w+", dtype=np.int64, shape=(n_rows,)
+            )
+            for start in range(0, n_rows, block_size):
+                out[start : start + block_size] = raw[start : start + block_size]
+            out.flush()
+            del raw, out
+            os.remove(raw_file)
+        KeyIndex.write(os.path.join(path, "entities.keys"), entities)
+        KeyIndex.write(os.path.join(path, "relations.keys"), relations)
+        # -- renamed last, like `atomic_write` (written aside, then renamed in one step)
+        for name in _COLUMNS:
+            out_file = os.path.join(path, f"{name}.npy")
+            os.replace(f"{out_file}.tmp", out_file)
+        return cls.load(path)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "FactStore":
+        """build the store from a KG DataFrame with the columns h,r,t"""
+        return cls.from_dataframes([df])
+
+    def extend(self, df: pd.DataFrame) -> "FactStore":
+        """a new store with the facts of `df` added"""
+        return self.from_dataframes([df], base=self)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """the facts as a DataFrame of categorical h,r,t columns (sorted by pair)"""
+        entities = pd.Index(list(self.entities))
+        relations = pd.Index(list(self.relations))
+        return pd.DataFrame(
+            {
+                "h": pd.Categorical.from_codes(self.heads, categories=entities),
+                "r": pd.Categorical.from_codes(self.relation_codes, categories=relations),
+                "t": pd.Categorical.from_codes(self.tail_codes, categories=entities),
+            }
+        )
+
+    def save(self, path: str) -> None:
+        """writes the store as a snapshot directory (see the module doc)"""
+        from .key_index import KeyIndex
+
+        os.makedirs(path, exist_ok=True)
+        KeyIndex.write(os.path.join(path, "entities.keys"), self.entities)
+        KeyIndex.write(os.path.join(path, "relations.keys"), self.relations)
+        arrays = [self.heads, self.relation_codes, self.tail_codes, self.pairs, self.offsets]
+        for name, array in zip(_COLUMNS, arrays):
+            with atomic_write(os.path.join(path, f"{name}.npy")) as out:
+                np.save(out, np.asarray(array))
+
+    @classmethod
+    def load(cls, path: str) -> "FactStore":
+        """memory-maps a snapshot directory written by `save`"""
+        from .key_index import KeyIndex
+
+        arrays = [
+            np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in _COLUMNS
+        ]
+        return cls(
+            KeyIndex(os.path.join(path, "entities.keys")),
+            KeyIndex(os.path.join(path, "relations.keys")),
+            *arrays,
+        )
+
+    def _pair(self, h: str, r: str) -> int:
+        """index of the pair (h, r) in `pairs`, or -1"""
+        h_id = self.entities.row(h)
+        r_id = self.relations.row(r)
+        if h_id is None or r_id is None:
+            return -1
+        key = h_id * max(len(self.relations), 1) + r_id
+        idx = int(np.searchsorted(self.pairs, key))
+        return idx if idx < len(self.pairs) and self.pairs[idx] == key else -1
+
+    def tails(self, h: str, r: str) -> List[str]:
+        """returns all tails `t` where h->r->t occurs (empty list if none)"""
+        idx = self._pair(h, r)
+        if idx < 0:
+            return []
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return [self.entities[t] for t in self.tail_codes[start:end].tolist()]
+
+    def __contains__(self, pair: Tuple[str, str]) -> bool:
+        return self._pair(*pair) >= 0
+
+    def __len__(self) -> int:
+        return len(self.tail_codes)
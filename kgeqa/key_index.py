@@ -0,0 +1,129 @@
+"""
+Compact, memory-mapped key index for the ENT/REL models
+
+A sidecar file (`ENT.vec.magnitude.keys`) holding the model's keys, lower cased,
+so the key sets can be loaded without iterating (and decoding) every vector.
+The builder also writes the keys as they are (`ENT.vec.magnitude.names`, same layout),
+to regenerate the model on `--append`: that file is only read by row.
+
+File layout (little-endian):
+    header   b"KGQK", uint32 version, uint64 n
+    offsets  uint64[n + 1]  -- byte offsets of each key in `blob`, in row order
+    order    uint32[n]      -- row ids sorted by key bytes (for binary search)
+    blob     utf-8 keys concatenated
+"""
+import mmap
+import struct
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .utils.files import atomic_write
+
+_MAGIC = b"KGQK"
+_VERSION = 1
+_HEADER = struct.Struct("<4sIQ")
+
+SIDECAR_SUFFIX = ".keys"
+NAMES_SUFFIX = ".names"
+
+
+def sidecar_path(model_path: str) -> str:
+    """e.g. data/ENT.vec.magnitude -> data/ENT.vec.magnitude.keys"""
+    return f"{model_path}{SIDECAR_SUFFIX}"
+
+
+def names_path(model_path: str) -> str:
+    """e.g. data/ENT.vec.magnitude -> data/ENT.vec.magnitude.names (keys not lower cased)"""
+    return f"{model_path}{NAMES_SUFFIX}"
+
+
+def _encode(keys: Iterable[str], lower: bool = True) -> Tuple[int, List[bytes]]:
+    """the number of `keys` and the parts of their key index (see the module doc)"""
+    encoded = [(str(k).lower() if lower else str(k)).encode("utf-8") for k in keys]
+    n = len(encoded)
+    offsets = np.zeros(n + 1, dtype="<u8")
+    np.cumsum([len(k) for k in encoded], out=offsets[1:])
+    order = np.array(sorted(range(n), key=encoded.__getitem__), dtype="<u4")
+    header = _HEADER.pack(_MAGIC, _VERSION, n)
+    return n, [header, offsets.tobytes(), order.tobytes(), b"".join(encoded)]
+
+
+class KeyIndex:
+    """read-only set-like view over a key index file (or the same bytes in memory)"""
+
+    path: Optional[str]
+    offsets: np.ndarray
+    order: np.ndarray
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._attach(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def from_keys(cls, keys: Iterable[str]) -> "KeyIndex":
+        """an index of `keys` (lower cased) held in memory, e.g. when it can't be written"""
+        index = cls.__new__(cls)
+        index.path = None
+        index._attach(b"".join(_encode(keys)[1]))
+        return index
+
+    def _attach(self, buf) -> None:
+        self._buf = buf
+        magic, version, n = _HEADER.unpack_from(self._buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"Not a key index file (v{_VERSION}): {self.path}")
+        pos = _HEADER.size
+        self.offsets = np.frombuffer(self._buf, dtype="<u8", count=n + 1, offset=pos)
+        pos += 8 * (n + 1)
+        self.order = np.frombuffer(self._buf, dtype="<u4", count=n, offset=pos)
+        self._blob_start = pos + 4 * n
+        self._n = n
+
+    @staticmethod
+    def write(path: str, keys: Iterable[str], lower: bool = True) -> int:
+        """writes `keys` (lower cased unless not `lower`, in row order) to `path`,
+        returns the number of keys
+        """
+        n, parts = _encode(keys, lower)
+        with atomic_write(path) as out:
+            for part in parts:
+                out.write(part)
+        return n
+
+    def _key_bytes(self, row: int) -> bytes:
+        start = self._blob_start + int(self.offsets[row])
+        end = self._blob_start + int(self.offsets[row + 1])
+        return self._buf[start:end]
+
+    def __getitem__(self, row: int) -> str:
+        return self._key_bytes(row).decode("utf-8")
+
+    def row(self, key: str) -> Optional[int]:
+        """returns the row id of `key` (binary search), or None"""
+        target = key.lower().encode("utf-8")
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_bytes(int(self.order[mid])) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n:
+            row = int(self.order[lo])
+            if self._key_bytes(row) == target:
+                return row
+        return None
+
+    def __contains__(self, key: str) -> bool:
+        return self.row(key) is not None
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(self._n))
+
+    def tolist(self) -> List[str]:
+        return list(self)
@@ -0,0 +1,132 @@
+"""
+Shared reader of the KG datasets (csv/tsv files of h,r,t facts)
+
+The columns are read as categoricals (one string per distinct value, int codes
+per row), with the pyarrow csv engine when it is installed, and transformed per
+distinct value (e.g. lower cased with a vectorized `.str.lower()` of the categories)
+instead of per row.
+
+Usage:
+
+    from kgeqa.kg_reader import read_kg
+    df = read_kg("data/KG.csv")  # h, t lower cased
+    df = read_kg("train.txt", sep="\t", header=False, lower=(), usecols=["r"])
+    for chunk in read_kg("big.csv", chunksize=1000000, where=lambda df: df["r"] == "genre"):
+        ...
+"""
+from typing import Callable, Iterable, Iterator, List, Mapping, Union
+
+import numpy as np
+import pandas as pd
+
+from .utils.logger import logging
+
+COLUMNS = ["h", "r", "t"]
+
+
+def csv_engine(chunksize: int = 0) -> str:
+    """pyarrow if installed (it doesn't read in chunks), else pandas' C parser"""
+    if not chunksize:
+        try:
+            import pyarrow  # noqa: F401
+
+            return "pyarrow"
+        except ImportError:
+            pass
+    return "c"
+
+
+def _recode(col: pd.Series, categories: Iterable) -> pd.Series:
+    """categorical `col` with each category replaced by the matching value of `categories`
+    (values may collide, e.g. 'Rome' and 'rome' once lower cased)
+    """
+    codes, uniques = pd.factorize(np.asarray(list(categories), dtype=object))
+    old_codes = col.cat.codes.values
+    new_codes = np.where(old_codes < 0, -1, codes[old_codes])
+    return pd.Series(
+        pd.Categorical.from_codes(new_codes, categories=uniques), index=col.index, name=col.name
+    )
+
+
+def lower(col: pd.Series) -> pd.Series:
+    """lower cased `col` (once per distinct value if categorical)"""
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        return _recode(col, col.cat.categories.astype(str).str.lower())
+    return col.astype(str).str.lower()
+
+
+def map_distinct(col: pd.Series, func: Union[Callable[[str], str], Mapping]) -> pd.Series:
+    """`col` with `func` applied (or values found in the mapping `func` replaced),
+    once per distinct value if categorical
+    """
+    if isinstance(func, Mapping):
+        mapping = func
+        func = lambda x: mapping.get(x, x)
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        return _recode(col, [func(c) for c in col.cat.categories])
+    return col.map(func)
+
+
+def distinct(df: pd.DataFrame, columns: List[str]) -> np.ndarray:
+    """unique values of `columns` (e.g. ["h", "t"]), from the categories if categorical"""
+    values = []
+    for col in columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            values.append(np.asarray(df[col].cat.categories, dtype=object))
+        else:
+            values.append(np.asarray(df[col].values, dtype=object))
+    return pd.unique(np.concatenate(values)) if values else np.zeros(0, dtype=object)
+
+
+def _prepare(
+    df: pd.DataFrame, lower_columns: Iterable[str], where: Callable = None
+) -> pd.DataFrame:
+    keep = df.notna().all(axis=1).values
+    if not keep.all():
+        logging.warning(f"skipping {int((~keep).sum())} facts with a missing h, r or t")
+    if where is not None:
+        keep &= np.asarray(where(df), dtype=bool)
+    if not keep.all():
+        df = df[keep].copy()
+        # -- drop the categories of the filtered out rows
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].cat.remove_unused_categories()
+    for col in lower_columns:
+        if col in df.columns:
+            df[col] = lower(df[col])
+    return df
+
+
+def read_kg(
+    path: str,
+    sep: str = ",",
+    header: bool = True,
+    usecols: List[str] = None,
+    lower: Iterable[str] = ("h", "t"),
+    categorical: bool = True,
+    where: Callable[[pd.DataFrame], pd.Series] = None,
+    chunksize: int = 0,
+) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    """reads the KG facts at `path` as a DataFrame with (`usecols` of) the columns h,r,t
+
+    :param header: whether the first line is a header (the columns are named h,r,t anyway)
+    :param lower: columns to lower case
+    :param categorical: read the columns as categoricals (else as strings)
+    :param where: row filter, e.g. `lambda df: df["r"] == "genre"`
+        (the facts with a missing h, r or t are skipped anyway)
+    :param chunksize: if set, returns an iterator over DataFrames of that many facts
+    """
+    kwargs = dict(
+        sep=sep,
+        header=0 if header else None,
+        names=COLUMNS,
+        usecols=usecols,
+        dtype="category" if categorical else str,
+        engine=csv_engine(chunksize),
+    )
+    lower_columns = list(lower)
+    if chunksize:
+        chunks = pd.read_csv(path, chunksize=chunksize, **kwargs)
+        return (_prepare(df, lower_columns, where) for df in chunks)
+    return _prepare(pd.read_csv(path, **kwargs), lower_columns, where)
@@ -1,41 +1,340 @@
-import pandas as pd
-import pymagnitude
+"""
+Lazily loaded models and KG data
+
+Nothing is loaded at import time. Each resource is registered with a loader
+and is opened the first time it is accessed, either as a module attribute
+(e.g. `load_models.ENTITY_VECTORS_MODEL`) or through `get(name)`.
+How long each load took is kept in `LOAD_TIMES`.
+
+Resources are loaded once even when first accessed from several threads at a time,
+and are then shared read-only by all the threads.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, List
 
 from .params import (
     WORD_VECTORS_MODEL_LOCATION,
+    WORD_VECTORS_TRIMMED_LOCATION,
     ENTITY_VECTORS_DB_LOCATION,
     RELATION_VECTORS_DB_LOCATION,
     KG_DATASET_LOCATION,
+    NEIGHBORS_DTYPE,
+    NEIGHBORS_MMAP,
+    ANN_N_PROBE,
+    NEIGHBORS_TOP_N,
+    _THRESHOLD_MAX_CONFIDENCE,
+    _THRESHOLD_MIN_CONFIDENCE,
 )
 from .utils.logger import logging
 
 
-# --- TO LOAD AT SYSTEM INIT --- #
-
-
-def load_embedding_model(path: str) -> pymagnitude.Magnitude:
+def load_embedding_model(path: str) -> "pymagnitude.Magnitude":
     # github.com/plasticityai/magnitude
+    import pymagnitude
+
     logging.info(f"loading embedding model from:\n {path}")
     vectors = pymagnitude.Magnitude(path=path)
     return vectors
 
 
-def read_kg_data():
-    logging.info(f"reading knowledge graph data from:\n{KG_DATASET_LOCATION}")
-    df = pd.read_csv(KG_DATASET_LOCATION)
+def load_kg_snapshot(kg_path: str = KG_DATASET_LOCATION):
+    """returns the facts snapshot written by the builder next to the KG dataset (memory-mapped),
+    or None if there is none or it is older than the dataset
+    """
+    import os
+    from .fact_store import FactStore, snapshot_path
+
+    path = snapshot_path(kg_path)
+    if not os.path.isdir(path):
+        return None
+    if os.path.exists(kg_path) and os.path.getmtime(path) < os.path.getmtime(kg_path):
+        logging.warning(f"ignoring the facts snapshot older than the dataset: {path}")
+        return None
+    logging.info(f"loading knowledge graph snapshot from:\n{path}")
+    return FactStore.load(path)
+
+
+def word_model_location() -> str:
+    """the trimmed word model built for the KG if any, else the full word model"""
+    import os
+
+    if os.path.exists(WORD_VECTORS_TRIMMED_LOCATION):
+        return WORD_VECTORS_TRIMMED_LOCATION
+    return WORD_VECTORS_MODEL_LOCATION
+
+
+def load_question_model():
+    """the word model embedding the question tokens (see `word_model_location`)"""
+    path = word_model_location()
+    if path == WORD_VECTORS_MODEL_LOCATION:
+        return get("WORD_VECTORS_MODEL")
+    return load_embedding_model(path)
+
+
+def read_kg_data(kg_path: str = KG_DATASET_LOCATION):
+    from .kg_reader import read_kg
+
+    facts = load_kg_snapshot(kg_path)
+    if facts is not None:
+        return facts.to_dataframe()
+    logging.info(f"reading knowledge graph data from:\n{kg_path}")
     # lower case heads/tails
-    df["h"] = df["h"].apply(lambda x: x.lower())
-    df["t"] = df["t"].apply(lambda x: x.lower())
-    return df
+    return read_kg(kg_path, lower=("h", "t"))
+
+
+def load_model_keys(name: str, path: str):
+    """
+    returns the lower cased keys of the model at `path`, from its sidecar key index.
+    If the sidecar is missing, the keys are read from model `name` once and the sidecar is written
+    (or they are kept in memory if it can't be)
+    """
+    from .key_index import KeyIndex, sidecar_path
+
+    keys_path = sidecar_path(path)
+    try:
+        return KeyIndex(keys_path)
+    except FileNotFoundError:
+        logging.warning(f"no key index at {keys_path}, reading keys from the model ..")
+    keys = [key for key, _ in get(name)]
+    try:
+        KeyIndex.write(keys_path, keys)
+    except OSError:  # e.g. read-only data dir
+        return KeyIndex.from_keys(keys)
+    return KeyIndex(keys_path)
+
+
+def load_model_matrix(name: str, path: str, n_rows: int = None):
+    """returns the (unit-normalized) vectors matrix of model `name` at `path`, rows in key order,
+    from the builder's MODEL.vec.magnitude.npy if any (without opening the model),
+    or its reduced-precision MODEL.vec.magnitude.<NEIGHBORS_DTYPE>.npy if any
+    (and of `n_rows` rows, the number of keys, else it's left by a former build).
+    Memory-mapped read-only with `NEIGHBORS_MMAP`
+    """
+    import os
+    import numpy as np
+    from .neighbors import matrix_path
+    from .quantize import QuantizedMatrix
+
+    mmap_mode = "r" if NEIGHBORS_MMAP else None
+    reduced_path = matrix_path(path, NEIGHBORS_DTYPE)
+    if reduced_path != matrix_path(path) and os.path.exists(reduced_path):
+        if np.dtype(NEIGHBORS_DTYPE) == np.int8:
+            reduced = QuantizedMatrix.load(reduced_path, mmap_mode)
+        else:
+            reduced = np.load(reduced_path, mmap_mode=mmap_mode)
+        if n_rows is None or len(reduced) == n_rows:
+            return reduced
+        logging.warning(
+            f"ignoring the matrix of {len(reduced)} rows for {n_rows} keys: {reduced_path} "
+            f"(rebuild it with `--precision {NEIGHBORS_DTYPE}`)"
+        )
+    try:
+        return np.load(matrix_path(path), mmap_mode=mmap_mode)
+    except FileNotFoundError:
+        if NEIGHBORS_MMAP:
+            logging.warning(f"no {matrix_path(path)} to memory-map, reading the model ..")
+        return np.asarray(get(name).get_vectors_mmap())
+
+
+def load_ann_index(path: str, n_rows: int = None):
+    """returns the ANN index built alongside the model at `path`, or None (exact search),
+    also if it doesn't index the `n_rows` rows of the model's matrix (e.g. left by a former build)
+    """
+    from .ann import IVFIndex, ann_index_path
+
+    try:
+        index = IVFIndex.load(ann_index_path(path))
+    except FileNotFoundError:
+        return None
+    if n_rows is not None and len(index.rows) != n_rows:
+        logging.warning(
+            f"ignoring the ANN index of {len(index.rows)} rows for a matrix of {n_rows} rows: "
+            f"{ann_index_path(path)} (rebuild it with `--ann`)"
+        )
+        return None
+    return index
+
+
+def build_neighbor_engine(
+    entity_path: str = ENTITY_VECTORS_DB_LOCATION,
+    relation_path: str = RELATION_VECTORS_DB_LOCATION,
+):
+    from .neighbors import NeighborEngine
+
+    entity_keys = get("ENTITY_VECTORS_KEYS")
+    relation_keys = get("RELATION_VECTORS_KEYS")
+    entity_matrix = load_model_matrix("ENTITY_VECTORS_MODEL", entity_path, len(entity_keys))
+    relation_matrix = load_model_matrix(
+        "RELATION_VECTORS_MODEL", relation_path, len(relation_keys)
+    )
+    return NeighborEngine(
+        entity_keys,
+        entity_matrix,
+        relation_keys,
+        relation_matrix,
+        dtype=NEIGHBORS_DTYPE,
+        entity_ann=load_ann_index(entity_path, len(entity_matrix)),
+        relation_ann=load_ann_index(relation_path, len(relation_matrix)),
+        n_probe=ANN_N_PROBE,
+        normalized=NEIGHBORS_MMAP,
+    )
+
+
+def build_fact_store(kg_path: str = KG_DATASET_LOCATION):
+    from .fact_store import FactStore
 
+    facts = load_kg_snapshot(kg_path)
+    if facts is not None:
+        return facts
+    return FactStore.from_dataframe(get("KG_DATABASE"))
 
-# -- Word Embeddings Model
-EMBEDDING_MODEL = load_embedding_model(WORD_VECTORS_MODEL_LOCATION)
+
+# --- LOADED ON FIRST USE --- #
+
+_LOADERS: Dict[str, Callable[[], Any]] = {}
+_RESOURCES: Dict[str, Any] = {}
+LOAD_TIMES: Dict[str, float] = {}  # name -> seconds
+_GENERATION = 0  # bumped whenever a resource is replaced or dropped
+_DATA_VERSION = (None, None)  # (generation, data_version()) of the last call
+_LOCK = threading.RLock()  # -- reentrant: loaders `get()` the resources they depend on
+
+
+def fingerprint() -> int:
+    """identifies the currently loaded models, changes when any of them is replaced
+    (e.g. after `BuildKGModels.run`), so caches keyed by it invalidate themselves
+    """
+    return _GENERATION
+
+
+def _answer_files() -> List[str]:
+    """the files the answers are computed from: the models, the ENT/REL key indexes,
+    matrices (float32 and `NEIGHBORS_DTYPE`) and ANN indexes, the KG and its snapshot
+    """
+    import os
+    from .ann import ann_index_path
+    from .fact_store import snapshot_path
+    from .key_index import sidecar_path
+    from .neighbors import matrix_path
+    from .quantize import scales_path
+
+    paths = [WORD_VECTORS_MODEL_LOCATION, WORD_VECTORS_TRIMMED_LOCATION, KG_DATASET_LOCATION]
+    for path in (ENTITY_VECTORS_DB_LOCATION, RELATION_VECTORS_DB_LOCATION):
+        paths += [path, sidecar_path(path), matrix_path(path), ann_index_path(path)]
+        reduced = matrix_path(path, NEIGHBORS_DTYPE)
+        if reduced != matrix_path(path):
+            paths += [reduced, scales_path(reduced)]
+    snapshot = snapshot_path(KG_DATASET_LOCATION)
+    paths += [os.path.join(snapshot, name) for name in sorted(_listdir(snapshot))]
+    return paths
+
+
+def _listdir(path: str) -> List[str]:
+    import os
+
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+def data_version() -> str:
+    """identifies the model/KG files on disk (paths, sizes and modification times) and the
+    search settings the answers depend on, stable across restarts and changed by a rebuild
+    """
+    import hashlib
+    import os
+
+    global _DATA_VERSION
+    generation, version = _DATA_VERSION
+    if generation == _GENERATION:
+        return version
+    generation = _GENERATION
+    stats = [
+        f"NEIGHBORS_DTYPE:{NEIGHBORS_DTYPE}",
+        f"ANN_N_PROBE:{ANN_N_PROBE}",
+        f"NEIGHBORS_TOP_N:{NEIGHBORS_TOP_N}",
+        f"THRESHOLDS:{_THRESHOLD_MIN_CONFIDENCE}:{_THRESHOLD_MAX_CONFIDENCE}",
+    ]
+    for path in _answer_files():
+        try:
+            st = os.stat(path)
+            stats.append(f"{path}:{st.st_size}:{st.st_mtime_ns}")
+        except OSError:
+            stats.append(f"{path}:-")
+    version = hashlib.sha1("|".join(stats).encode("utf-8")).hexdigest()[:16]
+    _DATA_VERSION = (generation, version)
+    return version
+
+
+def register(name: str, loader: Callable[[], Any]) -> None:
+    """register (or replace) the `loader` of resource `name`"""
+    global _GENERATION
+    with _LOCK:
+        _LOADERS[name] = loader
+        _RESOURCES.pop(name, None)
+        _GENERATION += 1
+
+
+def get(name: str) -> Any:
+    """returns resource `name`, loading it on first use"""
+    try:
+        return _RESOURCES[name]
+    except KeyError:
+        pass
+    with _LOCK:
+        # -- another thread may have loaded it while this one waited
+        if name in _RESOURCES:
+            return _RESOURCES[name]
+        start = time.perf_counter()
+        resource = _LOADERS[name]()
+        LOAD_TIMES[name] = time.perf_counter() - start
+        logging.info(f"loaded '{name}' in {LOAD_TIMES[name]:.3f}s")
+        _RESOURCES[name] = resource
+        return resource
+
+
+def is_loaded(name: str) -> bool:
+    return name in _RESOURCES
+
+
+def reset(*names: str) -> None:
+    """drop loaded resources (all of them if no `names`) so they reload on next use"""
+    global _GENERATION
+    with _LOCK:
+        for name in names or list(_RESOURCES):
+            _RESOURCES.pop(name, None)
+            LOAD_TIMES.pop(name, None)
+        _GENERATION += 1
+
+
+def __getattr__(name: str) -> Any:
+    # module-level lazy attributes (PEP 562)
+    if name in _LOADERS:
+        return get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# -- Word Embeddings Model (the full one, used by the builder)
+register("WORD_VECTORS_MODEL", lambda: load_embedding_model(WORD_VECTORS_MODEL_LOCATION))
+# -- Word Embeddings of the question tokens (the trimmed model, if built)
+register("EMBEDDING_MODEL", load_question_model)
 # -- Entity Embeddings Model
-ENTITY_VECTORS_MODEL = load_embedding_model(ENTITY_VECTORS_DB_LOCATION)
-ENTITY_VECTORS_KEYS = set(map(lambda x: x[0].lower(), ENTITY_VECTORS_MODEL))
+register("ENTITY_VECTORS_MODEL", lambda: load_embedding_model(ENTITY_VECTORS_DB_LOCATION))
+register(
+    "ENTITY_VECTORS_KEYS",
+    lambda: load_model_keys("ENTITY_VECTORS_MODEL", ENTITY_VECTORS_DB_LOCATION),
+)
 # -- Relation Embeddings Model
-RELATION_VECTORS_MODEL = load_embedding_model(path=RELATION_VECTORS_DB_LOCATION)
-RELATION_VECTORS_KEYS = set(map(lambda x: x[0].lower(), RELATION_VECTORS_MODEL))
+register(
+    "RELATION_VECTORS_MODEL", lambda: load_embedding_model(RELATION_VECTORS_DB_LOCATION)
+)
+register(
+    "RELATION_VECTORS_KEYS",
+    lambda: load_model_keys("RELATION_VECTORS_MODEL", RELATION_VECTORS_DB_LOCATION),
+)
+# -- Exact nearest-neighbors over the ENT/REL vectors
+register("NEIGHBOR_ENGINE", build_neighbor_engine)
 # -- Knowledge (Facts) Graph dataset
-KG_DATABASE = read_kg_data()
+register("KG_DATABASE", read_kg_data)
+register("KG_FACTS", build_fact_store)
@@ -3,15 +3,28 @@ The Main KGE_QA Algorithm
 """
 # Wed Oct 30 21:33:30 EDT 2019
 # Author: Aziz Altowayan
-from typing import List, Tuple, Iterator
+from dataclasses import replace
+from typing import Dict, List, Tuple, Iterator
 
-from .config import Token
+from . import load_models as models
+from .cache import PersistentLRUCache
+from .config import Token, Tensor
+from .metrics import Trace, timer
 from .utils.logger import logging
-from .params import TYPE_ENTITY, TYPE_RELATION
+from .params import (
+    TYPE_ENTITY,
+    TYPE_RELATION,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_LOCATION,
+    NEIGHBORS_TOP_N,
+)
 from .preprocess import tokenize
 from .model import (
     generate_embedding,
+    generate_embeddings,
+    find_closest_neighbors,
     is_true_key,
+    label_true_key,
     decide_closest_neighbor,
     form_pairs,
     pick_potential_pair,
@@ -24,36 +37,66 @@ from .model import (
 
 
 class KGE_QA(object):
-    """Factoid Question Answering based on Knowledge Graph Embeddings"""
+    """Factoid Question Answering based on Knowledge Graph Embeddings
+
+    One instance per question: each phase builds new tokens from the previous ones
+    (the input tokens are never modified), and the models/KG are only read,
+    so questions can be answered concurrently from several threads.
+    The time spent in each phase is kept in `trace` (see `kgeqa.metrics`)
+    """
 
     input_tokens: Iterator[Token]
     labeled_tokens: List[Token]
     swapped_tokens: List[Token]
     candidate_pairs: List[Tuple[Token, Token]]
     results: Tuple[str, str, List[str]]
+    trace: Trace
+
+    def __init__(self):
+        self.trace = Trace()
 
     def tokenize(self, question: str) -> None:
-        self.input_tokens = tokenize(question)
+        self.trace.question = question
+        with self.trace.active(), timer("tokenize"):
+            self.input_tokens = list(tokenize(question))
+
+    def cache_key(self) -> str:
+        """the filtered tokens of the question plus the version of the models/KG"""
+        import json
+
+        return json.dumps([models.data_version()] + [t.name for t in self.input_tokens])
 
-    def _phase1_identify_and_label_tokens(self):
-        """label each token i.e. POS either ENT, REL, or OTHER"""
+    def _phase1_identify_and_label_tokens(
+        self, precomputed: Dict[str, Tuple[Tensor, List[Tuple[Token, float]]]] = None
+    ):
+        """label each token i.e. POS either ENT, REL, or OTHER
+        `precomputed` maps a token name to its (vector, neighbors), see `answer_batch()`
+        """
 
         self.labeled_tokens = list()
-        for token in self.input_tokens:
+        for input_token in self.input_tokens:
 
             # if the token is a true ENT/REL, keep as is and skip finding its neighbors
-            if is_true_key(token):
-                self.labeled_tokens.append(token)
+            labeled = label_true_key(input_token)
+            if labeled is not None:
+                self.labeled_tokens.append(labeled)
                 continue
 
-            # -- Embed the input `token.name` into a vector (and update `token.vector` value)
-            token.vector = generate_embedding(token)
+            neighbors = None
+            if precomputed and input_token.name in precomputed:
+                vector, neighbors = precomputed[input_token.name]
+            else:
+                # -- Embed the input `token.name` into a vector
+                vector = generate_embedding(input_token)
+            token = replace(input_token, vector=vector)
 
             # -- The important magic happens here:
             # decide the type of the input token by matching
             # it with its closest neighbor in our ENT/REL models
             closest_neighbor, distance = decide_closest_neighbor(
-                current_token=token, processed_tokens=self.labeled_tokens
+                current_token=token,
+                processed_tokens=self.labeled_tokens,
+                neighbors=neighbors,
             )
 
             # -- Fill in current_token's params
@@ -65,38 +108,39 @@ class KGE_QA(object):
             self.labeled_tokens.append(token)
 
     def _phase2_swap_from_input_to_kg_tokens(self):
-        v = [(x.name, x.type) for x in self.labeled_tokens]
-        logging.info(f"\nLABELED TOKENS:\n{v}")
         self.swapped_tokens = [t.closest_token for t in self.labeled_tokens]
 
-        v = [(x.name, s.name) for x, s in zip(self.labeled_tokens, self.swapped_tokens)]
-        logging.info(f"\nSWAPPED TOKENS:\n{v}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            v = [(x.name, x.type) for x in self.labeled_tokens]
+            logging.debug("LABELED TOKENS:\n%s", v)
+            v = [(x.name, s.name) for x, s in zip(self.labeled_tokens, self.swapped_tokens)]
+            logging.debug("SWAPPED TOKENS:\n%s", v)
 
     def _phase3_form_incomplete_triplets(self):
-        # -- keep only ENT/REL types i.e. discard the type OTHER
-        ents_kge_tokens = [t for t in self.swapped_tokens if t.type == TYPE_ENTITY]
-        rels_kge_tokens = [t for t in self.swapped_tokens if t.type == TYPE_RELATION]
-        # -- form incomplete triplets pairs
-        self.candidate_pairs = form_pairs(ents_kge_tokens, rels_kge_tokens)
+        """forms the incomplete pairs and picks the most likely one, if any"""
+        with timer("pair_selection"):
+            # -- keep only ENT/REL types i.e. discard the type OTHER
+            ents_kge_tokens = [t for t in self.swapped_tokens if t.type == TYPE_ENTITY]
+            rels_kge_tokens = [t for t in self.swapped_tokens if t.type == TYPE_RELATION]
+            # -- form incomplete triplets pairs
+            self.candidate_pairs = form_pairs(ents_kge_tokens, rels_kge_tokens)
+            if self.candidate_pairs:
+                self.pair = pick_potential_pair(self.candidate_pairs)
 
     def _phase4_find_missing_tail(self):
-        """receives incomplete pairs, pick one, and complete it with its missing tail(s)"""
+        """completes the picked pair with its missing tail(s)"""
         if not self.candidate_pairs:
             self.results = None, None, "Invalid question!"
             return
-        head, relation = pick_potential_pair(self.candidate_pairs)
-        tail = find_closest_pair_in_kg(head, relation)
+        head, relation = self.pair
+        with timer("kg_lookup"):
+            tail = find_closest_pair_in_kg(head, relation)
         self.results = head, relation, tail
 
 
-def answer(question: str) -> Tuple[str, str, List[str]]:
-    """The pipeline for the answering task"""
-
-    kgeqa = KGE_QA()
-    kgeqa.tokenize(question)
-
+def _answer_phases(kgeqa: KGE_QA, precomputed=None) -> Tuple[str, str, List[str]]:
     # -- phase 1: extract entities and relations from the input question
-    kgeqa._phase1_identify_and_label_tokens()
+    kgeqa._phase1_identify_and_label_tokens(precomputed)
 
     # -- phase 2: swap from the question's tokens to the closest matched tokens from our models
     # TODO: perhaps here we need to keep one entity and one relation only!
@@ -109,12 +153,82 @@ def answer(question: str) -> Tuple[str, str, List[str]]:
     # -- phase 4: (fact-completion) get the missing entity (of the incomplete triplet) from the KG dataset
     kgeqa._phase4_find_missing_tail()
 
-    entity, relation, result = kgeqa.results
-    print(f"Answer: {result}")
+    return kgeqa.results
+
+
+# -- whole-question results, keyed by `KGE_QA.cache_key()`
+ANSWER_CACHE = PersistentLRUCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_LOCATION)
+
+
+def _cached_answer_phases(kgeqa: KGE_QA, precomputed=None) -> Tuple[str, str, List[str]]:
+    with kgeqa.trace.active(), timer("answer"):
+        key = kgeqa.cache_key()
+        results = ANSWER_CACHE.get(key)
+        kgeqa.trace.cached = results is not None
+        if results is None:
+            results = _answer_phases(kgeqa, precomputed)
+            ANSWER_CACHE.put(key, list(results))
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        # -- one structured record per question (see KGEQA_LOG_FORMAT=json)
+        head, relation, result = results
+        logging.info(
+            "answered %r: %s",
+            kgeqa.trace.question,
+            kgeqa.trace,
+            extra=dict(
+                request=kgeqa.trace.as_dict(), head=head, relation=relation, answer=result
+            ),
+        )
+    return tuple(results)
+
+
+def answer(question: str) -> Tuple[str, str, List[str]]:
+    """The pipeline for the answering task"""
+
+    kgeqa = KGE_QA()
+    kgeqa.tokenize(question)
+    entity, relation, result = _cached_answer_phases(kgeqa)
 
     return entity, relation, result
 
 
+def answer_batch(questions: List[str]) -> List[Tuple[str, str, List[str]]]:
+    """The answering pipeline for many questions at once:
+    the unique tokens of the whole batch are embedded in one query
+    and matched against the ENT/REL models in one matrix product
+    """
+
+    pipelines = []
+    for question in questions:
+        kgeqa = KGE_QA()
+        kgeqa.tokenize(question)
+        pipelines.append(kgeqa)
+
+    # -- unique tokens (of the not yet answered questions) that need their neighbors
+    names = list(
+        {
+            t.name: None
+            for kgeqa in pipelines
+            if kgeqa.cache_key() not in ANSWER_CACHE
+            for t in kgeqa.input_tokens
+            if not is_true_key(t)
+        }
+    )
+    vectors = generate_embeddings(names)
+    neighbors = find_closest_neighbors(names, vectors, n=NEIGHBORS_TOP_N)
+    precomputed = dict(zip(names, zip(vectors, neighbors)))
+
+    return [_cached_answer_phases(kgeqa, precomputed) for kgeqa in pipelines]
+
+
+def answer_record(question: str, results: Tuple[str, str, List[str]]) -> Dict:
+    """JSON-serializable result of `question`"""
+    head, relation, result = results
+    record = dict(question=question, head=head, relation=relation)
+    record["answer"] = result if isinstance(result, str) else list(result)
+    return record
+
+
 ############################
 # -- Command-line Entry -- #
 ############################
@@ -124,13 +238,85 @@ def main():
     question = input("enter your question >> ")
     # print(f"question: {question}")
     ans = answer(question)
+    print(f"Answer: {ans[2]}")
     print(f"KG pair: {ans[0]}->{ans[1]}->?")
     # print(f"answer: {ans}")
 
 
+def read_questions(path: str) -> List[str]:
+    """reads questions from a .jsonl file (`{"question": ...}` per line)
+    or a .tsv/.txt file (question in the first column)
+    """
+    import json
+
+    questions = []
+    with open(path) as in_file:
+        for line in in_file:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            if path.endswith((".jsonl", ".json")):
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    record = record["question"]
+                questions.append(record)
+            else:
+                questions.append(line.split("\t")[0])
+    return questions
+
+
+def main_batch(path: str, batch_size: int = 1024):
+    """answers all the questions in `path`, writes one JSON result per line to stdout"""
+    import json
+    import sys
+
+    questions = read_questions(path)
+    for i in range(0, len(questions), batch_size):
+        batch = questions[i : i + batch_size]
+        for question, results in zip(batch, answer_batch(batch)):
+            sys.stdout.write(json.dumps(answer_record(question, results)) + "\n")
+
+
+def write_stats(path: str, format: str = "json") -> None:
+    """writes the phase latencies and cache hit rates to `path` ('-' for stderr),
+    as a JSON dump or in Prometheus text format (see `kgeqa.metrics`)
+    """
+    import json
+    import sys
+    from . import metrics
+
+    if format == "prometheus":
+        text = metrics.to_prometheus()
+    else:
+        text = json.dumps(metrics.stats(), indent=2) + "\n"
+    if path == "-":
+        sys.stderr.write(text)
+    else:
+        with open(path, "w") as out_file:
+            out_file.write(text)
+
+
 if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("--batch", help="file of questions (.jsonl or .tsv) to answer")
+    parser.add_argument("--batch_size", type=int, default=1024)
+    parser.add_argument(
+        "--stats", help="file to write the phase latencies and cache stats to ('-': stderr)"
+    )
+    parser.add_argument("--stats_format", choices=["json", "prometheus"], default="json")
+    args = parser.parse_args()
+
     try:
-        while True:
-            main()
-    except KeyboardInterrupt:
-        print("\nEnd of QA system! Good bye.")
+        if args.batch:
+            main_batch(args.batch, args.batch_size)
+        else:
+            try:
+                while True:
+                    main()
+            except KeyboardInterrupt:
+                print("\nEnd of QA system! Good bye.")
+    finally:
+        if args.stats:
+            write_stats(args.stats, args.stats_format)
@@ -0,0 +1,230 @@
+"""
+Latency metrics of the answering pipeline
+
+Each timed call (`with timer("embedding"): ...`) is observed in the histogram of its phase,
+and added to the `Trace` of the request being answered, if any:
+
+    tokenize        splitting the question into tokens (`KGE_QA.tokenize`)
+    embedding       embedding token names with the word model
+    neighbors       searching the closest ENT/REL keys of token vectors
+    pair_selection  forming the (ENT, REL) pairs and picking one
+    kg_lookup       finding the tails of the pair in the KG
+    answer          the whole question, from its tokens to its answer
+
+The histograms and the cache hit rates are exported with `stats()` (JSON)
+or `to_prometheus()` (Prometheus text format), e.g. by `python -m kgeqa.main --stats`
+or the `/metrics` endpoint of `kgeqa.serve`.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+# -- upper bounds (seconds) of the histogram buckets, the last one is +Inf
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Histogram:
+    """counts of observed durations per bucket, with their count and sum"""
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # -- the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """`q`-quantile estimated from the buckets (interpolated within its bucket)"""
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self.count, self.sum
+            buckets = dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts))
+        return dict(
+            count=count,
+            sum=total,
+            mean=total / count if count else 0.0,
+            p50=self.quantile(0.5),
+            p90=self.quantile(0.9),
+            p99=self.quantile(0.99),
+            buckets=buckets,
+        )
+
+
+class Trace:
+    """per-phase durations (seconds) of one request, summed over the phase's calls"""
+
+    question: Optional[str]
+    timings: Dict[str, float]
+    calls: Dict[str, int]
+    cached: Optional[bool]  # answered from the answers cache
+
+    def __init__(self, question: str = None):
+        self.question = question
+        self.timings = {}
+        self.calls = {}
+        self.cached = None
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    @contextmanager
+    def active(self) -> Iterator["Trace"]:
+        """the timers of this thread/task add to this trace meanwhile"""
+        token = _TRACE.set(self)
+        try:
+            yield self
+        finally:
+            _TRACE.reset(token)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(
+            question=self.question,
+            cached=self.cached,
+            timings=dict(self.timings),
+            calls=dict(self.calls),
+        )
+
+    def __str__(self) -> str:
+        timings = ", ".join(f"{p}={s * 1000:.2f}ms" for p, s in self.timings.items())
+        return f"{timings} (cached: {self.cached})"
+
+
+_TRACE: contextvars.ContextVar = contextvars.ContextVar("kgeqa_trace", default=None)
+_HISTOGRAMS: Dict[str, Histogram] = {}
+_LOCK = threading.Lock()
+
+
+def current_trace() -> Optional[Trace]:
+    return _TRACE.get()
+
+
+def histogram(phase: str) -> Histogram:
+    """the histogram of `phase`, created on first use"""
+    hist = _HISTOGRAMS.get(phase)
+    if hist is None:
+        with _LOCK:
+            hist = _HISTOGRAMS.setdefault(phase, Histogram())
+    return hist
+
+
+def observe(phase: str, seconds: float) -> None:
+    histogram(phase).observe(seconds)
+    trace = _TRACE.get()
+    if trace is not None:
+        trace.add(phase, seconds)
+
+
+@contextmanager
+def timer(phase: str) -> Iterator[None]:
+    """times the block as one call of `phase`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, time.perf_counter() - start)
+
+
+def reset() -> None:
+    """drop the observed durations (the cache counters are kept by the caches)"""
+    with _LOCK:
+        _HISTOGRAMS.clear()
+
+
+def cache_stats() -> Dict[str, Dict[str, float]]:
+    from .main import ANSWER_CACHE
+    from .model import cache_stats as token_cache_stats
+
+    stats = token_cache_stats()
+    stats["answers"] = ANSWER_CACHE.stats()
+    return stats
+
+
+def stats() -> Dict[str, Any]:
+    """JSON-serializable dump of the phase histograms and the cache stats"""
+    with _LOCK:
+        histograms = dict(_HISTOGRAMS)
+    return dict(
+        phases={phase: hist.as_dict() for phase, hist in sorted(histograms.items())},
+        caches=cache_stats(),
+    )
+
+
+def _prometheus_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def to_prometheus() -> str:
+    """the phase histograms and the cache stats in Prometheus text format"""
+    with _LOCK:
+        histograms = sorted(_HISTOGRAMS.items())
+    lines: List[str] = [
+        "# HELP kgeqa_phase_seconds Duration of the answering pipeline phases.",
+        "# TYPE kgeqa_phase_seconds histogram",
+    ]
+    for phase, hist in histograms:
+        with hist._lock:
+            counts, count, total = list(hist.counts), hist.count, hist.sum
+        cumulative = 0
+        for bound, n in zip([str(b) for b in hist.buckets] + ["+Inf"], counts):
+            cumulative += n
+            lines.append(
+                f'kgeqa_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(f'kgeqa_phase_seconds_sum{{phase="{phase}"}} {total!r}')
+        lines.append(f'kgeqa_phase_seconds_count{{phase="{phase}"}} {count}')
+
+    caches = cache_stats()
+    for name, key, type_, help_ in [
+        ("kgeqa_cache_hits_total", "hits", "counter", "Cache lookups found."),
+        ("kgeqa_cache_misses_total", "misses", "counter", "Cache lookups not found."),
+        ("kgeqa_cache_evictions_total", "evictions", "counter", "Cache entries evicted."),
+        ("kgeqa_cache_size", "size", "gauge", "Cache entries held."),
+        ("kgeqa_cache_hit_ratio", "hit_rate", "gauge", "Cache hits per lookup."),
+    ]:
+        lines.append(f"# HELP {name} {help_}")
+        lines.append(f"# TYPE {name} {type_}")
+        for cache, cache_stats_ in sorted(caches.items()):
+            value = _prometheus_value(cache_stats_[key])
+            lines.append(f'{name}{{cache="{cache}"}} {value}')
+    return "\n".join(lines) + "\n"
@@ -1,88 +1,176 @@
 """The Magic"""
 # Author: Aziz Altowayan (November, 2019)
 import itertools
-from typing import List, Tuple
+import threading
+from dataclasses import replace
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 
+
+from .cache import LRUCache
+from .metrics import timer
 from .config import Token, Tensor
 from .utils.logger import logging
 from .params import (
     TYPE_RELATION,
     TYPE_ENTITY,
     TYPE_OTHER,
+    TOKEN_CACHE_SIZE,
+    NEIGHBORS_TOP_N,
     _THRESHOLD_MAX_CONFIDENCE,
     _THRESHOLD_MIN_CONFIDENCE,
 )
-from .load_models import (
-    EMBEDDING_MODEL,
-    ENTITY_VECTORS_MODEL,
-    ENTITY_VECTORS_KEYS,
-    RELATION_VECTORS_MODEL,
-    RELATION_VECTORS_KEYS,
-    KG_DATABASE,
-)
+from . import load_models as models  # lazily loaded: models.ENTITY_VECTORS_MODEL, ...
+
+# -- memoized per token name: its embedding, and its neighbors as (name, type, score)
+EMBEDDING_CACHE = LRUCache(TOKEN_CACHE_SIZE)
+NEIGHBORS_CACHE = LRUCache(TOKEN_CACHE_SIZE)
+_cached_fingerprint = None
+_fingerprint_lock = threading.Lock()
+
+
+def _cache_key(*parts) -> tuple:
+    """key by the current models' fingerprint, dropping stale entries when models change"""
+    global _cached_fingerprint
+    fp = models.fingerprint()
+    if fp != _cached_fingerprint:
+        with _fingerprint_lock:
+            if fp != _cached_fingerprint:
+                EMBEDDING_CACHE.clear()
+                NEIGHBORS_CACHE.clear()
+                _cached_fingerprint = fp
+    return (fp,) + parts
+
+
+def cache_stats() -> Dict[str, Dict[str, float]]:
+    return dict(embeddings=EMBEDDING_CACHE.stats(), neighbors=NEIGHBORS_CACHE.stats())
 
 
 def generate_embedding(token: Token) -> Tensor:
     """Use a pre-trained model to get/calculate a vector for the input `token.name`"""
-    logging.info(f"\nGenerating embedding for current TOKEN: '{token.name}'")
-    tensor = EMBEDDING_MODEL.query(token.name)  # return: ndarray i.e. Token
+    key = _cache_key(token.name)
+    tensor = EMBEDDING_CACHE.get(key)
+    if tensor is None:
+        logging.debug("Generating embedding for current TOKEN: '%s'", token.name)
+        model = models.EMBEDDING_MODEL  # -- loaded (on first use) outside the timer
+        with timer("embedding"):
+            tensor = model.query(token.name)  # return: ndarray i.e. Token
+        tensor.setflags(write=False)  # shared through the cache
+        EMBEDDING_CACHE.put(key, tensor)
     return tensor
 
 
-def find_closest(word: Token, model, top_n=3) -> List[Tuple[str, float]]:
-    """
-    returns the `topn` closest words to `word` from `model`
-    return structure [(word1, cosine_dist), (word2, cosine_dist), (...)]
-    """
-    return model.most_similar(word.name, topn=top_n)
+def generate_embeddings(names: List[str]) -> Tensor:
+    """Embed many token names at once, returns a matrix with one row per name"""
+    if not names:
+        return np.zeros((0, models.EMBEDDING_MODEL.dim), dtype=np.float32)
+    keys = [_cache_key(name) for name in names]
+    cached = [EMBEDDING_CACHE.get(key) for key in keys]
+    missing = [i for i, v in enumerate(cached) if v is None]
+    logging.debug(
+        "Generating embeddings for %d TOKENS (%d requested)", len(missing), len(names)
+    )
+    if missing:
+        model = models.EMBEDDING_MODEL
+        with timer("embedding"):
+            vectors = np.asarray(model.query([names[i] for i in missing]))
+        vectors.setflags(write=False)
+        for i, vector in zip(missing, vectors):
+            cached[i] = vector
+            EMBEDDING_CACHE.put(keys[i], vector)
+    return np.stack(cached)
+
+
+def _query_vector(token: Token) -> Tensor:
+    if isinstance(token.vector, np.ndarray):
+        return token.vector
+    return generate_embedding(token)
 
 
 def find_closest_relations(token: Token, n: int = 3) -> List[Tuple[Token, float]]:
     """Computes distances between `token` and relations in our `REL.vec`"""
-    closest_n_relations = find_closest(
-        word=token, model=RELATION_VECTORS_MODEL, top_n=n
-    )
-    results = []
-    for closest, distance in closest_n_relations:
-        neighbor = Token(name=closest, type=TYPE_RELATION, type_confidence=1.0)
-        neighbor.vector = None  # TODO: consider adding the neighbor's vector as well.
-        results.append((neighbor, distance))
-    m = f"Closest '{n}' neighbors of type 'RELATION': {closest_n_relations}"
-    logging.info(m)
+    engine = models.NEIGHBOR_ENGINE
+    vector = _query_vector(token)
+    with timer("neighbors"):
+        results = engine.relations.closest(vector, n)[0]
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        v = [(t.name, c) for t, c in results]
+        logging.debug("Closest '%d' neighbors of type 'RELATION': %s", n, v)
     return results
 
 
 def find_closest_entities(token: Token, n: int = 3) -> List[Tuple[Token, float]]:
     """Computes distances between `token` and all entities in our `ENT.vec`"""
-    closest_n_entities = find_closest(word=token, model=ENTITY_VECTORS_MODEL, top_n=n)
-    results = []
-    for closest, distance in closest_n_entities:
-        neighbor = Token(name=closest, type=TYPE_ENTITY, type_confidence=1.0)
-        neighbor.vector = None  # TODO: consider add the neighbor's vector as well.
-        results.append((neighbor, distance))
-    m = f"Closest '{n}' neighbors of type 'ENTITY': {closest_n_entities}"
-    logging.info(m)
+    engine = models.NEIGHBOR_ENGINE
+    vector = _query_vector(token)
+    with timer("neighbors"):
+        results = engine.entities.closest(vector, n)[0]
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        v = [(t.name, c) for t, c in results]
+        logging.debug("Closest '%d' neighbors of type 'ENTITY': %s", n, v)
     return results
 
 
+def find_closest_batch(vectors: Tensor, n: int = 3) -> List[List[Tuple[Token, float]]]:
+    """closest `n` entities + closest `n` relations for each row of `vectors`"""
+    engine = models.NEIGHBOR_ENGINE
+    with timer("neighbors"):
+        return engine.search(vectors, n)
+
+
+def _as_tokens(neighbors) -> List[Tuple[Token, float]]:
+    """fresh Tokens from cached (name, type, score) neighbors"""
+    return [
+        (Token(name=name, type=type_, type_confidence=1.0), score)
+        for name, type_, score in neighbors
+    ]
+
+
+def find_closest_neighbors(
+    names: List[str], vectors: Tensor = None, n: int = 3
+) -> List[List[Tuple[Token, float]]]:
+    """memoized `find_closest_batch` for the tokens `names` (embedded if no `vectors`)"""
+    keys = [_cache_key(name, n) for name in names]
+    cached = [NEIGHBORS_CACHE.get(key) for key in keys]
+    missing = [i for i, c in enumerate(cached) if c is None]
+    if missing:
+        if vectors is None:
+            queries = generate_embeddings([names[i] for i in missing])
+        else:
+            queries = np.asarray(vectors)[missing]
+        for i, neighbors in zip(missing, find_closest_batch(queries, n)):
+            cached[i] = tuple((t.name, t.type, c) for t, c in neighbors)
+            NEIGHBORS_CACHE.put(keys[i], cached[i])
+    return [_as_tokens(c) for c in cached]
+
+
+def true_key_type(name: str) -> Optional[str]:
+    """TYPE_ENTITY or TYPE_RELATION if `name` is already a true key in our models, else None"""
+    if name in models.ENTITY_VECTORS_KEYS:
+        logging.debug("The token '%s' is a True ENTITY in 'ENTITY_VECTORS_KEYS'", name)
+        return TYPE_ENTITY
+    if name in models.RELATION_VECTORS_KEYS:
+        logging.debug("The token '%s' is a True RELATION in 'RELATION_VECTORS_KEYS'", name)
+        return TYPE_RELATION
+    return None
+
+
 def is_true_key(token: Token) -> bool:
     """check if `token.name` is already a true entity/relation key in our model"""
-    if token.name in ENTITY_VECTORS_KEYS:
-        m = f"The token '{token.name}' is a True ENTITY in 'ENTITY_VECTORS_KEYS'"
-        logging.info(m)
-        token.type = TYPE_ENTITY
-        token.type_confidence = 1.0
-        token.closest_token = token  # closest token is self
-        return True
-    if token.name in RELATION_VECTORS_KEYS:
-        m = f"The token '{token.name}' is a True RELATION in 'RELATION_VECTORS_KEYS'"
-        logging.info(m)
-        token.type = TYPE_RELATION
-        token.type_confidence = 1.0
-        token.closest_token = token
-        return True
-    return False
+    return true_key_type(token.name) is not None
+
+
+def label_true_key(token: Token) -> Optional[Token]:
+    """a copy of `token` labeled as the true ENT/REL key it is (its own closest token),
+    or None if it's not a key
+    """
+    key_type = true_key_type(token.name)
+    if key_type is None:
+        return None
+    labeled = replace(token, type=key_type, type_confidence=1.0)
+    labeled.closest_token = labeled  # closest token is self
+    return labeled
 
 
 def already_found_entity_token(tokens: List[Token]) -> bool:
@@ -92,58 +180,61 @@ def already_found_entity_token(tokens: List[Token]) -> bool:
     return False
 
 
-def sequence_matcher(target: str, word: str) -> float:
-    from difflib import SequenceMatcher as SM
-
-    ratio = SM(a=target.lower(), b=word.lower()).ratio()
-    logging.info(f".. SM({target}, {word}) = {ratio:.2f}")
-    return ratio
+def string_similarity(target: str, tokens: List[Token]) -> Tensor:
+    """character n-gram similarity of `target` to each of the neighbor `tokens`, in one call"""
+    return models.NEIGHBOR_ENGINE.string_similarity(target, tokens)
 
 
 def decide_closest_neighbor(
-    current_token: Token, processed_tokens: List[Token]
+    current_token: Token,
+    processed_tokens: List[Token],
+    neighbors: Optional[List[Tuple[Token, float]]] = None,
 ) -> Tuple[Token, float]:
     """
-    Input: the currently being processed `token` and previously `processed_tokens`
+    Input: the currently being processed `token` and previously `processed_tokens`,
+    optionally with its already computed `neighbors` (e.g. from `find_closest_batch`)
     Return: the most likely closest neighbor to `token` along the with distance
+    (a new Token: neither the inputs nor the `neighbors` are modified)
     """
 
-    # -- get token's nearest neighbors in our embeddings models,
-    # neighbors are mixture of ENTs and RELs types
-    closest_entities = find_closest_entities(current_token, n=3)
-    closest_relations = find_closest_relations(current_token, n=3)
-    neighbors = closest_entities + closest_relations
+    if neighbors is None:
+        # -- get token's nearest neighbors in our embeddings models,
+        # neighbors are mixture of ENTs and RELs types
+        n = NEIGHBORS_TOP_N
+        vectors = [_query_vector(current_token)]
+        neighbors = find_closest_neighbors([current_token.name], vectors, n=n)[0]
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            v = [(t.name, t.type, c) for t, c in neighbors]
+            logging.debug("Closest '%d' neighbors of types 'ENTITY' and 'RELATION': %s", n, v)
 
     # -- sort neighbors by CosineSim (in DESC order),
     # and take the one with max cosine similarity score
-    neighbors.sort(key=lambda tup: tup[1], reverse=True)
+    neighbors = sorted(neighbors, key=lambda tup: tup[1], reverse=True)
     neighbor_token, distance = neighbors[0]  # max(cosine similarity of the neighbors)
 
     if distance < _THRESHOLD_MAX_CONFIDENCE:
-        # -- take the max of (sequenceMatcher ratio + cosine similarity) / 2
-        candidates = {
-            t.name: round((c + sequence_matcher(current_token.name, t.name)) / 2, 2)
-            for t, c in neighbors
-        }
-        # -- sort by the avg score (in DESC order) and take the max
-        candidates = sorted(candidates.items(), key=lambda kv: kv[1], reverse=True)
-        closest, distance = candidates[0]
-        neighbor_token, distance = (
-            [t for t, c in neighbors if t.name == closest][0],
-            distance,
-        )
-        logging.info(f"candidates avg. distance: {candidates}")
-
-    m = f"The closest neighbor: '{neighbor_token.name}', type: '{neighbor_token.type}', distance: {distance:.2f}"
-    logging.info(m)
+        # -- take the max of (string similarity + cosine similarity) / 2
+        tokens = [t for t, _ in neighbors]
+        cosine = np.array([c for _, c in neighbors])
+        scores = np.round((cosine + string_similarity(current_token.name, tokens)) / 2, 2)
+        best = int(np.argmax(scores))  # first max i.e. the higher cosine on ties
+        neighbor_token, distance = tokens[best], float(scores[best])
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            v = sorted(zip([t.name for t in tokens], scores.tolist()), key=lambda kv: -kv[1])
+            logging.debug("candidates avg. distance: %s", v)
+
+    logging.debug(
+        "The closest neighbor: '%s', type: '%s', distance: %.2f",
+        neighbor_token.name,
+        neighbor_token.type,
+        distance,
+    )
 
     if distance < _THRESHOLD_MIN_CONFIDENCE:
         # if the input token is neither ENT nor REL
-        neighbor_token.name = TYPE_OTHER
-        neighbor_token.type = TYPE_OTHER
-        distance = 0.0
+        return Token(name=TYPE_OTHER, type=TYPE_OTHER, type_confidence=1.0), 0.0
 
-    return neighbor_token, distance  # (Token, cosine_similarity)
+    return replace(neighbor_token), distance  # (Token, cosine_similarity)
 
 
 def form_pairs(
@@ -152,19 +243,19 @@ def form_pairs(
     """formulate `(entity, relation)` from the inputs"""
     if len(entities) < 1:
         ERROR_MSG = "INVALID! no 'Entities' found in the question"
-        logging.error(ERROR_MSG)
+        logging.info(ERROR_MSG)
     if len(relations) < 1:
         ERROR_MSG = "INVALID! no 'Relations' found in the question"
-        logging.error(ERROR_MSG)
+        logging.info(ERROR_MSG)
     product = list(itertools.product(entities, relations))
-    logging.info(f"\nCandidate pairs: {[(p1.name, p2.name) for p1, p2 in product]}")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Candidate pairs: %s", [(p1.name, p2.name) for p1, p2 in product])
     return product
 
 
-def pair_in_df_head_relation(h: str, r: str):
-    """returns rows where h->r occurs"""
-    row = KG_DATABASE[(KG_DATABASE["h"] == h) & (KG_DATABASE["r"] == r)]
-    return row
+def pair_in_df_head_relation(h: str, r: str) -> List[str]:
+    """returns tails where h->r occurs"""
+    return models.KG_FACTS.tails(h, r)
 
 
 def pick_potential_pair(pairs: List[Tuple[Token, Token]]) -> Tuple[str, str]:
@@ -178,13 +269,11 @@ def pick_potential_pair(pairs: List[Tuple[Token, Token]]) -> Tuple[str, str]:
     # -- swap to a pair exists in our model
     # check if the pair is: HEAD->RELATION
     for ent, rel in pairs:
-        db_pair = pair_in_df_head_relation(ent.name, rel.name)
-        if not db_pair.empty:
+        if (ent.name, rel.name) in models.KG_FACTS:
             pair = ent, rel
-            answer = db_pair["t"].iloc[0]
 
     ent, rel = pair  # assume
-    logging.info(f"\nSelected pair: ({ent.name}, {rel.name})")
+    logging.debug("Selected pair: (%s, %s)", ent.name, rel.name)
     return ent.name, rel.name
 
 
@@ -193,8 +282,7 @@ def find_closest_pair_in_kg(entity: str, relation: str) -> List[str]:
     use kge to find closest triplet to `input_pair`
     NOTE: perhaps no need to use KGE just use our original FB15K dataset to match the correct pair
     """
-    df = KG_DATABASE  # KGE dataset
-    t = df["t"][(df["h"] == entity) & (df["r"] == relation)]
-    if not t.empty:
-        return t.values
+    t = models.KG_FACTS.tails(entity, relation)
+    if t:
+        return t
     return ["No answer found!"]
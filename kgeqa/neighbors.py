@@ -0,0 +1,214 @@
+"""
+Exact nearest-neighbor search over the ENT/REL vectors
+
+The ENT and REL matrices are kept L2-normalized in contiguous NumPy arrays,
+so the cosine similarity of a query vector to every key is one matrix product
+and the top-k is picked with `argpartition` (no per-key lookups, no SQLite).
+The queries are scored in blocks of `_QUERY_ROWS` queries by `_BLOCK_ROWS` keys, keeping
+a running top-k, so a batch of queries never holds its full (queries x keys) scores.
+"""
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .ann import IVFIndex
+from .config import Token, Tensor
+from .params import TYPE_ENTITY, TYPE_RELATION
+from .quantize import QuantizedMatrix
+from .similarity import NGramTable
+
+_BLOCK_ROWS = 65536  # keys scored at a time (also bounds the float32 copy of float16/int8)
+_QUERY_ROWS = 256  # queries scored at a time: scores blocks of 256 x 65536 float32 (64MB)
+
+MATRIX_SUFFIX = ".npy"
+
+
+def matrix_path(model_path: str, dtype: str = "float32") -> str:
+    """e.g. data/ENT.vec.magnitude -> data/ENT.vec.magnitude.npy (written by the builder),
+    or data/ENT.vec.magnitude.float16.npy for a reduced `dtype`
+    """
+    if np.dtype(dtype) == np.float32:
+        return f"{model_path}{MATRIX_SUFFIX}"
+    return f"{model_path}.{np.dtype(dtype).name}{MATRIX_SUFFIX}"
+
+
+def normalize(matrix: Tensor, dtype=np.float32) -> Tensor:
+    """returns a contiguous, L2-normalized copy of `matrix` as `dtype`"""
+    matrix = np.array(matrix, dtype=np.float32, order="C", ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return np.ascontiguousarray(matrix, dtype=dtype)
+
+
+def _largest(scores: Tensor, k: int) -> Tuple[Tensor, Tensor]:
+    """(column ids, scores) of the (up to) `k` largest scores of each row, in no order"""
+    n = scores.shape[1]
+    if k >= n:
+        return np.broadcast_to(np.arange(n), scores.shape), scores
+    ids = np.argpartition(scores, n - k, axis=1)[:, n - k :]
+    return ids, np.take_along_axis(scores, ids, axis=1)
+
+
+class VectorTable:
+    """one type of keys (e.g. entities) with their normalized vectors,
+    searched exactly or, if it has an `ann` index, approximately (see `kgeqa.ann`).
+    The vectors are stored as `dtype`: float32, float16, or int8 (see `kgeqa.quantize`).
+    If `normalized`, the rows of `matrix` are unit vectors already and it is kept as is
+    """
+
+    keys: Sequence[str]
+    matrix: Tensor
+    type: str
+    ann: Optional[IVFIndex]
+    n_probe: int
+
+    def __init__(
+        self,
+        keys: Sequence[str],
+        matrix: Tensor,
+        type_: str,
+        dtype=np.float32,
+        ann: IVFIndex = None,
+        n_probe: int = 16,
+        normalized: bool = False,
+    ):
+        self.keys = keys
+        if isinstance(matrix, QuantizedMatrix) or (
+            normalized and matrix.dtype == np.dtype(dtype)
+        ):
+            # -- unit rows already (e.g. a read-only memory map of the builder's .npy), no copy
+            self.matrix = matrix
+        elif np.dtype(dtype) == np.int8:
+            self.matrix = QuantizedMatrix.quantize(normalize(matrix))
+        else:
+            self.matrix = normalize(matrix, dtype)
+        self.type = type_
+        self.ann = ann
+        self.n_probe = n_probe
+        self._ngrams = None
+        self._ngrams_lock = threading.Lock()
+
+    @property
+    def ngrams(self) -> NGramTable:
+        """character n-grams of every key, built on first use (by one thread)"""
+        if self._ngrams is None:
+            with self._ngrams_lock:
+                if self._ngrams is None:
+                    self._ngrams = NGramTable(self.keys)
+        return self._ngrams
+
+    def row(self, key: str) -> Optional[int]:
+        if hasattr(self.keys, "row"):  # KeyIndex
+            return self.keys.row(key)
+        try:
+            return self.keys.index(key)
+        except ValueError:
+            return None
+
+    def scores(self, vectors: Tensor, start: int = 0, stop: int = None) -> Tensor:
+        """cosine similarity of each (unit) row in `vectors` to the keys `start:stop` (all)"""
+        matrix = self.matrix
+        if isinstance(matrix, QuantizedMatrix):
+            # -- scored against the int8 codes: q . (codes * scales) == (q * scales) . codes
+            vectors, matrix = vectors * matrix.scales, matrix.codes
+        block = matrix[start:stop]
+        if block.dtype != np.float32:
+            block = block.astype(np.float32)
+        return vectors @ block.T
+
+    def top_k(self, vectors: Tensor, k: int) -> Tuple[Tensor, Tensor]:
+        """(row ids, scores) of the `k` closest keys to each row in `vectors`, best first"""
+        if self.ann is not None:
+            return self.ann.search(self.matrix, vectors, k, self.n_probe)
+        n_keys = len(self.matrix)
+        k = min(k, n_keys)
+        if k < 1:
+            empty = np.zeros((len(vectors), 0))
+            return empty.astype(np.int64), empty
+        top = np.empty((len(vectors), k), dtype=np.int64)
+        top_scores = np.empty((len(vectors), k), dtype=np.float32)
+        for q in range(0, len(vectors), _QUERY_ROWS):
+            queries = vectors[q : q + _QUERY_ROWS]
+            ids = np.zeros((len(queries), 0), dtype=np.int64)
+            scores = np.zeros((len(queries), 0), dtype=np.float32)
+            for start in range(0, n_keys, _BLOCK_ROWS):
+                # -- the block's top-k merged with the running top-k
+                block_scores = self.scores(queries, start, start + _BLOCK_ROWS)
+                block_ids, block_scores = _largest(block_scores, k)
+                ids = np.concatenate([ids, block_ids + start], axis=1)
+                scores = np.concatenate([scores, block_scores], axis=1)
+                best, scores = _largest(scores, k)
+                ids = np.take_along_axis(ids, best, axis=1)
+            order = np.argsort(-scores, axis=1)
+            top[q : q + len(queries)] = np.take_along_axis(ids, order, axis=1)
+            top_scores[q : q + len(queries)] = np.take_along_axis(scores, order, axis=1)
+        return top, top_scores
+
+    def tokens(self, ids: Tensor, scores: Tensor) -> List[List[Tuple[Token, float]]]:
+        """[(Token, cosine_similarity), ...] for each row of `ids`/`scores`"""
+        results = []
+        for row_ids, row_scores in zip(ids, scores):
+            neighbors = []
+            for i, score in zip(row_ids, row_scores):
+                if not np.isfinite(score):  # fewer than `k` ANN candidates
+                    continue
+                neighbor = Token(name=self.keys[int(i)], type=self.type, type_confidence=1.0)
+                neighbors.append((neighbor, float(score)))
+            results.append(neighbors)
+        return results
+
+    def closest(self, vectors: Tensor, k: int = 3) -> List[List[Tuple[Token, float]]]:
+        return self.tokens(*self.top_k(normalize(vectors), k))
+
+
+class NeighborEngine:
+    """top-k closest entities and relations of query vectors"""
+
+    entities: VectorTable
+    relations: VectorTable
+
+    def __init__(
+        self,
+        entity_keys: Sequence[str],
+        entity_matrix: Tensor,
+        relation_keys: Sequence[str],
+        relation_matrix: Tensor,
+        dtype=np.float32,
+        entity_ann: IVFIndex = None,
+        relation_ann: IVFIndex = None,
+        n_probe: int = 16,
+        normalized: bool = False,
+    ):
+        self.entities = VectorTable(
+            entity_keys, entity_matrix, TYPE_ENTITY, dtype, entity_ann, n_probe, normalized
+        )
+        self.relations = VectorTable(
+            relation_keys,
+            relation_matrix,
+            TYPE_RELATION,
+            dtype,
+            relation_ann,
+            n_probe,
+            normalized,
+        )
+
+    def string_similarity(self, word: str, tokens: List[Token]) -> Tensor:
+        """n-gram similarity of `word` to each of the ENT/REL neighbor `tokens`"""
+        scores = np.zeros(len(tokens))
+        for table in (self.entities, self.relations):
+            idx = [i for i, t in enumerate(tokens) if t.type == table.type]
+            rows = [table.row(tokens[i].name) for i in idx]
+            known = [(i, r) for i, r in zip(idx, rows) if r is not None]
+            if known:
+                idx, rows = zip(*known)
+                scores[list(idx)] = table.ngrams.similarity(word, rows)
+        return scores
+
+    def search(self, vectors: Tensor, k: int = 3) -> List[List[Tuple[Token, float]]]:
+        """closest `k` entities + closest `k` relations for each row of `vectors`"""
+        queries = normalize(vectors)
+        entities = self.entities.tokens(*self.entities.top_k(queries, k))
+        relations = self.relations.tokens(*self.relations.top_k(queries, k))
+        return [e + r for e, r in zip(entities, relations)]
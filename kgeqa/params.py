@@ -9,6 +9,9 @@ PARENT_DIR = dirname(dirname(abspath(__file__)))
 # $ curl http://magnitude.plasticity.ai/word2vec/medium/GoogleNews-vectors-negative300.magnitude -o GoogleNews-vectors-negative300.magnitude
 # $ curl http://magnitude.plasticity.ai/fasttext/medium/wiki-news-300d-1M-subword.magnitude -o ~/.magnitude/ft-wiki-news-300d-1M-subword.magnitude
 WORD_VECTORS_MODEL_LOCATION = f"{HOME_DIR}/.magnitude/ft-wiki-news-300d-1M-subword.magnitude"
+# -- word model trimmed to the KG domain (`build_new_model.py --word_model`), used instead of
+# the full one above to embed the question tokens when it exists
+WORD_VECTORS_TRIMMED_LOCATION = f"{PARENT_DIR}/data/WORDS.vec.magnitude"
 
 RELATION_VECTORS_DB_LOCATION = f"{PARENT_DIR}/data/REL.vec.magnitude"  # path to REL_DICT.vec
 ENTITY_VECTORS_DB_LOCATION = f"{PARENT_DIR}/data/ENT.vec.magnitude"  # path to ENT_DICT.vec
@@ -23,6 +26,29 @@ TYPE_ENTITY = "<ENTITY>"
 TYPE_RELATION = "<RELATION>"
 TYPE_OTHER = "<OTHER>"
 
+# -- storage precision of the ENT/REL matrices in the neighbor engine: "float32", "float16"
+# or "int8" (scalar quantized, see `kgeqa.quantize`), loaded from the builder's
+# MODEL.vec.magnitude.<dtype>.npy if it was built with `--precision <dtype>`
+NEIGHBORS_DTYPE = "float32"
+# -- serving mode for several worker processes: the ENT/REL matrices are used straight from
+# the builder's read-only memory-mapped MODEL.vec.magnitude.npy files (no per-process copy,
+# the pages are shared by all the processes), as are the key indexes and the KG snapshot
+NEIGHBORS_MMAP = False
+# -- lists probed per query when an ANN index (MODEL.vec.magnitude.ivf.npz) exists:
+# higher is better recall and slower queries
+ANN_N_PROBE = 16
+
+# -- closest entities (and as many relations) considered for each question token
+NEIGHBORS_TOP_N = 3
+
+# -- max number of tokens whose embedding/neighbors are memoized (see `kgeqa.model`)
+TOKEN_CACHE_SIZE = 50000
+
+# -- max number of whole-question results cached by `kgeqa.main.answer()`, and optionally
+# an SQLite file to keep them across restarts, e.g. f"{PARENT_DIR}/data/answers.sqlite"
+ANSWER_CACHE_SIZE = 10000
+ANSWER_CACHE_LOCATION = None
+
 _THRESHOLD_MAX_CONFIDENCE = 0.9
 _THRESHOLD_MIN_CONFIDENCE = 0.2
 
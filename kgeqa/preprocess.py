@@ -3,82 +3,124 @@ Preprocess and Tokenize the input question and output.
 
 Author: Aziz Altowayan (Nov, 2019)
 """
-from typing import List, Iterator
+from typing import Dict, Iterable, Iterator, List, Tuple
 import re
+import threading
 
 from .config import Token
 from .params import STOPWORDS
-from .model import ENTITY_VECTORS_KEYS, RELATION_VECTORS_KEYS
+from . import load_models as models
 from .utils.logger import logging
 
 
-def _remove_stopwords(raw_tokens: List[str]) -> List[str]:
-    logging.info(f"Raw TOKENS:\n\t{raw_tokens}")
-    return [t for t in raw_tokens if t not in STOPWORDS]
+def _remove_stopwords(raw_tokens: List[str], keep: Iterable[bool] = None) -> List[str]:
+    """drop stop words, except for the tokens flagged in `keep` (e.g. matched keys)"""
+    logging.debug("Raw TOKENS:\n\t%s", raw_tokens)
+    keep = keep or [False] * len(raw_tokens)
+    return [t for t, k in zip(raw_tokens, keep) if k or t not in STOPWORDS]
 
 
-def _ngrams(s: List[str], n: int = 2, i: int = 0) -> Iterator[List[str]]:
+class SpanTrie:
+    """Word-level trie of the multi-word ENT/REL keys, e.g.
+    'new york city' / 'new_york_city' -> ('new', 'york', 'city')
     """
-    For example,
-    >>> s = "Who is the author of".split()
-    >>> list(_ngrams(s))
-    [['Who', 'is'], ['is', 'the'], ['the', 'author'], ['author', 'of']]
-   """
-    while len(s[i : i + n]) == n:
-        yield s[i : i + n]
-        i += 1
 
+    _END = ""  # child holding the key of a complete phrase
 
-def _join_subwords(tokens: List[str]) -> List[str]:
+    def __init__(self, keys: Iterable[str]):
+        self.root: Dict[str, dict] = {}
+        self.size = 0
+        for key in keys:
+            words = re.split("[_ ]+", key.strip("_ "))
+            if len(words) > 1:
+                self.add(words, key)
+
+    def add(self, words: List[str], key: str) -> None:
+        node = self.root
+        for word in words:
+            node = node.setdefault(word, {})
+        # -- prefer the joined form e.g. 'new_york' over 'new york'
+        if self._END not in node or ("_" in key and "_" not in node[self._END]):
+            self.size += self._END not in node
+            node[self._END] = key
+
+    def longest_match(self, tokens: List[str], i: int) -> Tuple[str, int]:
+        """the longest key starting at `tokens[i]` and its length in tokens, or ('', 0)"""
+        node, key, length = self.root, "", 0
+        for j in range(i, len(tokens)):
+            node = node.get(tokens[j])
+            if node is None:
+                break
+            if self._END in node:
+                key, length = node[self._END], j - i + 1
+        return key, length
+
+
+_SPAN_TRIE: Dict[int, SpanTrie] = {}  # models fingerprint -> trie
+_SPAN_TRIE_LOCK = threading.Lock()
+
+
+def _span_trie() -> SpanTrie:
+    """the trie of the currently loaded ENT/REL keys, built once per models version"""
+    fp = models.fingerprint()
+    trie = _SPAN_TRIE.get(fp)
+    if trie is not None:
+        return trie
+    with _SPAN_TRIE_LOCK:  # -- built by one thread, the others wait for it
+        trie = _SPAN_TRIE.get(fp)
+        if trie is None:
+            keys = list(models.ENTITY_VECTORS_KEYS) + list(models.RELATION_VECTORS_KEYS)
+            trie = SpanTrie(keys)
+            _SPAN_TRIE.clear()
+            _SPAN_TRIE[fp] = trie
+            logging.info("built span trie of %d multi-word keys", trie.size)
+    return trie
+
+
+def _join_subwords(tokens: List[str]) -> Tuple[List[str], List[bool]]:
     """This should take care of compound Entities (i.e. NER) and Relations
-    How: for every 2-gram words check if they are in our embedding models' keys
+    How: one pass over the raw tokens, replacing the longest phrase (of any length)
+    that is a key in our embedding models
     # models: ENT.vec and REL.vec
     # e.g.
     'new york' -> 'new_york'
-    'tom cruise' -> 'tom_cruise'
+    'new york city' -> 'new_york_city'
     'directed by' -> 'directed_by'
-    'author of' -> 'author_of' # TODO: 'of' was removed in stopwords (retain it)
+    'author of' -> 'author_of'
+    Returns the new tokens, and which of them are matched keys
     """
-    new_tokens = []
-    grams = _ngrams(tokens)
+    trie = _span_trie()
+    new_tokens, is_key = [], []
     i = 0
     while i < len(tokens):
-        try:
-            pair = next(grams)
-        except StopIteration:
-            if i < len(tokens):
-                new_tokens.append(tokens[i])  # last word in tokens
-            break
-        joined = "_".join(pair)
-        spaced = " ".join(pair)
-        if joined in ENTITY_VECTORS_KEYS or joined in RELATION_VECTORS_KEYS:
-            new_tokens.append(joined)
-            i += 2
-        elif spaced in ENTITY_VECTORS_KEYS or spaced in RELATION_VECTORS_KEYS:
-            new_tokens.append(spaced)
-            i += 2
+        key, length = trie.longest_match(tokens, i)
+        if length:
+            new_tokens.append(key)
+            is_key.append(True)
+            i += length
         else:
             new_tokens.append(tokens[i])
+            is_key.append(False)
             i += 1
-    return new_tokens
+    return new_tokens, is_key
 
 
 def tokenize(text: str) -> Iterator[Token]:
     # remove symbols | split | lower case
-    logging.info(f"\n\n--------\nTokenizing the input query:\n\t'{text}'")
+    logging.debug("Tokenizing the input query:\n\t'%s'", text)
     tokens = re.findall("[a-z1-9_]+", text.lower())
 
     # assert len(tokens) > 2, "INVALID question! A question should have more than 2 words"
     if len(tokens) < 3:
-        logging.error("INVALID question! A question should have more than 2 words")
+        logging.info("INVALID question! A question should have more than 2 words")
 
     # TODO: consider using an nlp package for NER extraction
 
-    # 1) remove stop words except "by" e.g. "directed by"
-    tokens = _remove_stopwords(tokens)
+    # 1) concatenate sub-words of known keys as one token e.g. "directed by" -> "directed_by"
+    tokens, is_key = _join_subwords(tokens)
 
-    # 2) consider concatenating sub-words as one token e.g. "directed by" -> "directed_by"
-    tokens = _join_subwords(tokens)
+    # 2) remove stop words (outside of the matched keys)
+    tokens = _remove_stopwords(tokens, keep=is_key)
 
-    logging.info(f"Filtered TOKENS:\n\t{tokens}")
+    logging.debug("Filtered TOKENS:\n\t%s", tokens)
     return map(Token, tokens)
@@ -0,0 +1,71 @@
+"""
+int8 scalar quantization of the ENT/REL matrices
+
+Each dimension is scaled to [-127, 127] by its own scale (max abs value / 127), so
+a row is stored in 1 byte per dimension (4x smaller than float32) and
+    query . row ~= query . (codes * scales) == (query * scales) . codes
+i.e. a query is scored against the codes directly, after scaling it once.
+
+The builder writes the codes and the scales next to the model, e.g.
+`data/ENT.vec.magnitude.int8.npy` and `data/ENT.vec.magnitude.int8.scales.npy`.
+"""
+import os
+
+import numpy as np
+
+from .config import Tensor
+from .utils.files import atomic_write
+
+_BLOCK_ROWS = 65536
+
+
+def scales_path(codes_path: str) -> str:
+    """e.g. data/ENT.vec.magnitude.int8.npy -> data/ENT.vec.magnitude.int8.scales.npy"""
+    return f"{os.path.splitext(codes_path)[0]}.scales.npy"
+
+
+class QuantizedMatrix:
+    """int8 `codes` with per-dimension `scales`, indexed like a (decoded) float32 matrix"""
+
+    codes: Tensor  # (n, dim) int8
+    scales: Tensor  # (dim,) float32
+    dtype = np.dtype(np.int8)
+
+    def __init__(self, codes: Tensor, scales: Tensor):
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, rows) -> Tensor:
+        """the decoded float32 `rows`"""
+        return self.codes[rows].astype(np.float32) * self.scales
+
+    @classmethod
+    def quantize(cls, matrix: Tensor) -> "QuantizedMatrix":
+        """quantizes `matrix` block by block (it may be a memory map)"""
+        max_abs = np.zeros(matrix.shape[1], dtype=np.float32)
+        for start in range(0, len(matrix), _BLOCK_ROWS):
+            block = np.abs(np.asarray(matrix[start : start + _BLOCK_ROWS], np.float32))
+            np.maximum(max_abs, block.max(axis=0), out=max_abs)
+        scales = max_abs / 127
+        scales[scales == 0] = 1.0
+        codes = np.empty(matrix.shape, dtype=np.int8)
+        for start in range(0, len(matrix), _BLOCK_ROWS):
+            block = np.asarray(matrix[start : start + _BLOCK_ROWS], np.float32)
+            codes[start : start + len(block)] = np.clip(np.rint(block / scales), -127, 127)
+        return cls(codes, scales)
+
+    def save(self, path: str) -> None:
+        for out_file, array in [(path, self.codes), (scales_path(path), self.scales)]:
+            with atomic_write(out_file) as out:
+                np.save(out, array)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = None) -> "QuantizedMatrix":
+        return cls(np.load(path, mmap_mode=mmap_mode), np.load(scales_path(path)))
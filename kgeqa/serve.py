@@ -0,0 +1,294 @@
+"""
+Asyncio HTTP/JSON front-end of the answering pipeline
+
+Usage:
+
+    $ python -m kgeqa.serve --port 8000
+
+    $ curl -s localhost:8000/answer -d '{"question": "who directed saving private ryan?"}'
+    {"question": "...", "head": "saving_private_ryan", "relation": "directed_by", "answer": [...]}
+    $ curl -s "localhost:8000/answer?question=who+directed+saving+private+ryan"
+    $ curl -s localhost:8000/neighbors -d '{"tokens": ["director", "rome"], "n": 3}'
+    $ curl -s localhost:8000/metrics  # phase latencies and cache hit rates (Prometheus)
+    $ curl -s localhost:8000/stats  # the same as JSON
+
+Requests arriving concurrently are collected by a `MicroBatcher` and answered with one
+`answer_batch()` call, i.e. one embedding query and one neighbor-search matrix product
+for the whole batch. The batches run in a worker thread, so the event loop keeps
+accepting (and batching) requests meanwhile: the busier the server, the larger the batches.
+"""
+import asyncio
+import json
+from concurrent.futures import Executor, ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Callable, Dict, List, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from . import load_models as models
+from . import metrics
+from .main import answer_batch, answer_record
+from .model import find_closest_neighbors
+from .params import NEIGHBORS_TOP_N
+from .utils.logger import logging
+
+# -- most neighbors returned per token (and cached, the cache is bounded by entries only)
+MAX_NEIGHBORS_N = 100
+
+
+class MicroBatcher:
+    """collects the items submitted concurrently and runs `func(items) -> results` once
+    per batch in `executor`. A batch is run `window` seconds after its first item,
+    or as soon as it has `max_batch` items, and only one batch runs at a time:
+    items submitted meanwhile are batched together and run right after it
+    """
+
+    def __init__(
+        self,
+        func: Callable[[List[Any]], List[Any]],
+        executor: Executor,
+        window: float = 0.005,
+        max_batch: int = 256,
+    ):
+        self.func = func
+        self.executor = executor
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.items = 0
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer = None
+        self._running = False
+
+    async def submit(self, item: Any) -> Any:
+        """the result of `item`, once its batch has run"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._running or not self._pending:
+            return  # -- run when the current batch is done
+        batch = self._pending[: self.max_batch]
+        self._pending = self._pending[self.max_batch :]
+        self._running = True
+        asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self.executor, self.func, [item for item, _ in batch]
+            )
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.batches += 1
+            self.items += len(batch)
+            self._running = False
+            self._flush()
+
+
+def neighbors_batch(items: List[Tuple[str, int]]) -> List[List[Dict[str, Any]]]:
+    """the closest `n` entities and relations of each (token, n) in `items`,
+    the tokens of each `n` embedded and searched at once
+    """
+    results = [None] * len(items)
+    for n in set(n for _, n in items):
+        idx = [i for i, (_, n_) in enumerate(items) if n_ == n]
+        neighbors = find_closest_neighbors([items[i][0] for i in idx], n=n)
+        for i, token_neighbors in zip(idx, neighbors):
+            results[i] = [
+                dict(name=t.name, type=t.type, score=score) for t, score in token_neighbors
+            ]
+    return results
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Server:
+    """HTTP/1.1 (keep-alive) JSON server of the `/answer` and `/neighbors` endpoints"""
+
+    def __init__(self, window: float = 0.005, max_batch: int = 256):
+        # -- a single worker thread: one batch at a time through the pipeline
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kgeqa")
+        self.answers = MicroBatcher(answer_batch, self.executor, window, max_batch)
+        self.neighbors = MicroBatcher(neighbors_batch, self.executor, window, max_batch)
+        self.routes = {
+            "/answer": self.answer,
+            "/neighbors": self.closest_neighbors,
+            "/metrics": self.metrics,
+            "/stats": self.stats,
+        }
+
+    @staticmethod
+    def load_models() -> None:
+        """loads the models and the KG (instead of on the first request)"""
+        for name in [
+            "EMBEDDING_MODEL",
+            "ENTITY_VECTORS_KEYS",
+            "RELATION_VECTORS_KEYS",
+            "NEIGHBOR_ENGINE",
+            "KG_FACTS",
+        ]:
+            models.get(name)
+
+    async def answer(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        question = params.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "missing 'question'")
+        return answer_record(question, await self.answers.submit(question))
+
+    async def closest_neighbors(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        tokens = params.get("tokens", params.get("token"))
+        tokens = [tokens] if isinstance(tokens, str) else tokens
+        if not tokens or not all(isinstance(t, str) for t in tokens):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "missing 'tokens'")
+        try:
+            n = int(params.get("n", NEIGHBORS_TOP_N))
+        except (TypeError, ValueError):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "'n' is not an integer")
+        if not 1 <= n <= MAX_NEIGHBORS_N:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, f"'n' is not between 1 and {MAX_NEIGHBORS_N}"
+            )
+        results = await asyncio.gather(*[self.neighbors.submit((t, n)) for t in tokens])
+        return dict(neighbors=dict(zip(tokens, results)))
+
+    async def metrics(self, params: Dict[str, Any]) -> str:
+        return metrics.to_prometheus()
+
+    async def stats(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        stats = metrics.stats()
+        stats["batches"] = {
+            name: dict(batches=b.batches, items=b.items)
+            for name, b in [("answer", self.answers), ("neighbors", self.neighbors)]
+        }
+        return stats
+
+    async def dispatch(
+        self, method: str, target: str, body: bytes
+    ) -> Tuple[HTTPStatus, Any]:
+        url = urlsplit(target)
+        route = self.routes.get(url.path)
+        if route is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"unknown path {url.path}")
+        if method not in ("GET", "POST"):
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed")
+        params = dict(parse_qsl(url.query))
+        if body:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "invalid JSON body")
+            if not isinstance(payload, dict):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "the JSON body is not an object")
+            params.update(payload)
+        return HTTPStatus.OK, await route(params)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """serves the requests of one connection"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    body = await reader.readexactly(int(headers.get("content-length", 0)))
+                except ValueError:
+                    method, version = None, "HTTP/1.0"  # -- and close the connection
+                    status, payload = HTTPStatus.BAD_REQUEST, dict(error="bad request")
+                if method is not None:
+                    try:
+                        status, payload = await self.dispatch(method, target, body)
+                    except HTTPError as e:
+                        status, payload = e.status, dict(error=str(e))
+                    except Exception as e:
+                        logging.exception(f"failed to serve {request_line!r}")
+                        status = HTTPStatus.INTERNAL_SERVER_ERROR
+                        payload = dict(error=str(e))
+                keep_alive = (
+                    version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                )
+                if isinstance(payload, str):  # -- e.g. /metrics
+                    content_type = "text/plain; version=0.0.4"
+                    data = payload.encode("utf-8")
+                else:
+                    content_type = "application/json"
+                    data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode(
+                        "latin-1"
+                    )
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8000) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.load_models)
+        server = await asyncio.start_server(self.handle, host, port)
+        logging.info(f"serving on http://{host}:{port} ({', '.join(self.routes)})")
+        async with server:
+            await server.serve_forever()
+
+
+def main(host: str = "127.0.0.1", port: int = 8000, window=0.005, max_batch=256):
+    server = Server(window=window, max_batch=max_batch)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown()
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=0.005,
+        help="seconds to wait for more requests before running a batch",
+    )
+    parser.add_argument("--max_batch", type=int, default=256)
+    args = parser.parse_args()
+
+    main(args.host, args.port, args.window, args.max_batch)
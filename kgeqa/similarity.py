@@ -0,0 +1,59 @@
+"""
+Batched string similarity between a token and model keys
+
+Each key is reduced once to its set of character n-grams (an `NGramTable`),
+so scoring a token against many candidate keys is a single vectorized
+Dice-coefficient computation instead of one `difflib.SequenceMatcher` per candidate.
+"""
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from .config import Tensor
+
+
+def char_ngrams(word: str, n: int = 3) -> List[str]:
+    """unique character n-grams of `word` (lower cased, padded with a space)
+    >>> char_ngrams("film")
+    [' fi', 'fil', 'ilm', 'lm ']
+    """
+    padded = f" {word.lower()} "
+    grams = [padded[i : i + n] for i in range(max(1, len(padded) - n + 1))]
+    return list(dict.fromkeys(grams))
+
+
+class NGramTable:
+    """n-gram ids of every key, stored CSR-style (`offsets` into `ids`)"""
+
+    vocab: Dict[str, int]
+    offsets: Tensor
+    ids: Tensor
+
+    def __init__(self, keys: Sequence[str], n: int = 3):
+        self.n = n
+        self.vocab = {}
+        ids, lengths = [], []
+        for key in keys:
+            grams = char_ngrams(key, n)
+            ids.extend(self.vocab.setdefault(g, len(self.vocab)) for g in grams)
+            lengths.append(len(grams))
+        self.ids = np.array(ids, dtype=np.int32)
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+
+    def similarity(self, word: str, rows: Sequence[int]) -> Tensor:
+        """Dice coefficient between the n-grams of `word` and of each key in `rows`"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return np.zeros(0)
+        grams = char_ngrams(word, self.n)
+        query = np.array([self.vocab.get(g, -1) for g in grams], dtype=np.int32)
+        starts, ends = self.offsets[rows], self.offsets[rows + 1]
+        lengths = ends - starts
+        # -- gather the n-gram ids of all `rows` in one flat array
+        flat = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        flat += np.arange(lengths.sum())
+        hits = np.isin(self.ids[flat], query[query >= 0]).astype(np.int64)
+        overlap = np.zeros(len(rows), dtype=np.int64)
+        np.add.at(overlap, np.repeat(np.arange(len(rows)), lengths), hits)
+        return 2.0 * overlap / (len(grams) + lengths)
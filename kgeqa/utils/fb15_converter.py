@@ -1,5 +1,5 @@
 """from entity id to entity name or definition (FB15K dataset)"""
-from qa_system.utils.logger import logging
+from .logger import logging
 
 logging.info("loaded FB15 dictionary.")
 # also: http://webpage.pace.edu/aa10212w/thesis/data/fb15/entityWords.txt
@@ -70,18 +70,17 @@ def mid2concepts(
     flattened = {**flat1, **flat2, **flat3, **flat4}
 
     # -- read the `mid` filtered FB15K dataset
-    import pandas as pd
+    from ..kg_reader import map_distinct, read_kg
 
-    fb15k = pd.read_csv(input_csv)
+    fb15k = read_kg(input_csv, lower=())
 
-    # -- convert `mid` to actual concepts
-    fb15k["h"] = df["h"].apply(lambda x: flattened[x] if x in flattened else x)
-    fb15k["t"] = df["t"].apply(lambda x: flattened[x] if x in flattened else x)
+    # -- convert `mid` to actual concepts (once per distinct mid)
+    fb15k["h"] = map_distinct(fb15k["h"], flattened)
+    fb15k["t"] = map_distinct(fb15k["t"], flattened)
     # -- keep only triples with converted heads/tails concepts
     cleaned = fb15k[
         (~fb15k["h"].str.startswith("/")) & (~fb15k["t"].str.startswith("/"))
-    ]
-    concepts = cleaned["h"].tolist() + cleaned["t"].tolist()
+    ].copy()
     # -- remove paths from relations
-    cleaned = cleaned["r"] = cleaned["r"].apply(lambda x: str(x.split("/")[-1]))
+    cleaned["r"] = map_distinct(cleaned["r"], lambda x: str(x.split("/")[-1]))
     cleaned.to_csv(output_csv, index=False)
@@ -1,5 +1,5 @@
 """Filtering the relations of FB15K dataset"""
-import pandas as pd
+from ..kg_reader import read_kg
 
 # -- filtered domain relations
 film = [
@@ -55,7 +55,7 @@ people = [
 
 # -- how they were filtered
 SOURCE_FB15K = '/Users/Aziz/Downloads/rel-embedding/RelatedWork/fastText/scripts/kbcompletion/data/FB15k/freebase_mtr100_mte100-train.txt'
-df = pd.read_csv(SOURCE_FB15K, sep='\t', names=['h', 'r', 't'])
+df = read_kg(SOURCE_FB15K, sep='\t', header=False, lower=())
 
 
 # -- filtering FB15K on a given relationship keyword
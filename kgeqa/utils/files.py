@@ -0,0 +1,25 @@
+"""
+File helpers shared by the builder and the stores
+"""
+import os
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "wb") -> Iterator[IO]:
+    """opens `path.tmp` for writing, renamed to `path` once written (removed on error).
+
+    The files written by the builder are memory-mapped by the serving processes:
+    replacing a file by a rename leaves the readers mapping the old one unaffected,
+    and they never see a partly written file
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, mode) as out:
+            yield out
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
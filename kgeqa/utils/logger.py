@@ -1,9 +1,130 @@
+"""
+Logging of the package: `from .utils.logger import logging`
+
+Quiet by default (WARNING), the level and the format are set with environment variables:
+
+    KGEQA_LOG_LEVEL=DEBUG|INFO|WARNING|ERROR  (default: WARNING, INFO if invalid)
+    KGEQA_LOG_FORMAT=text|json  (json: one object per line, with the fields passed
+                                 as `extra=`, e.g. the trace of each answered question)
+
+The log calls only put their records on a queue: the messages are formatted and written
+by a background thread (a `QueueListener`), started by the first record logged (not at
+import, so processes can be forked before anything is logged; a forked child starts its own).
+Pass the arguments lazily, e.g. `logging.debug("neighbors: %s", neighbors)`, and guard
+the costly ones with `logging.getLogger().isEnabledFor(logging.DEBUG)`.
+"""
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
 import sys
+import threading
+
+LEVEL = os.environ.get("KGEQA_LOG_LEVEL", "WARNING").upper()
+FORMAT = os.environ.get("KGEQA_LOG_FORMAT", "text").lower()
+TEXT_FORMAT = "%(asctime)s : %(levelname)s : %(message)s"
+
+# -- attributes of every LogRecord, the others were passed as `extra=`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """one JSON object per record, with its `extra=` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = dict(
+            time=self.formatTime(record),
+            level=record.levelname,
+            logger=record.name,
+            message=record.getMessage(),
+        )
+        entry.update((k, v) for k, v in vars(record).items() if k not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """enqueues the records as they are, i.e. formatted by the listener's thread
+    (so the arguments of a log call should not be modified after it)
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        _start()
+        super().emit(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_LISTENER = None
+_STARTED = False
+_START_LOCK = threading.Lock()
+_CONFIG = None  # -- the arguments of the last `configure`, for forked children
+
+
+def level_number(level) -> int:
+    """the number of logging level `level` (e.g. "DEBUG"), None if it isn't a level"""
+    if isinstance(level, int):
+        return level
+    number = logging.getLevelName(str(level).upper())
+    return number if isinstance(number, int) else None
+
+
+def configure(level: str = LEVEL, format: str = FORMAT, stream=None) -> None:
+    """(re)configures the root logger to log at `level` to `stream` (stderr) through a queue"""
+    global _LISTENER, _CONFIG
+    _stop()
+    number = level_number(level)
+    _CONFIG = (logging.INFO if number is None else number, format, stream)
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JSONFormatter() if format == "json" else logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, DeferredQueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(_CONFIG[0])
+    _LISTENER = logging.handlers.QueueListener(records, handler)
+    if number is None:
+        logging.warning("invalid log level %r, logging at INFO", level)
+
+
+def _start() -> None:
+    # -- the listener's thread, on the first record
+    global _STARTED
+    if not _STARTED:
+        with _START_LOCK:
+            if not _STARTED and _LISTENER is not None:
+                _LISTENER.start()
+                _STARTED = True
+
+
+def _stop() -> None:
+    # -- writes the records still queued (e.g. at exit)
+    global _STARTED
+    with _START_LOCK:
+        if _STARTED:
+            _LISTENER.stop()
+            _STARTED = False
+
+
+def _after_fork() -> None:
+    # -- the parent's listener thread doesn't exist in a forked child: start a new one
+    global _STARTED, _START_LOCK
+    _STARTED = False
+    _START_LOCK = threading.Lock()
+    if _CONFIG is not None:
+        configure(*_CONFIG)
+
 
-logging.basicConfig(
-    format="%(asctime)s : %(levelname)s : %(message)s", level=logging.INFO
-)
+atexit.register(_stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+if not logging.getLogger().handlers:  # -- unless the application configured logging already
+    configure()
 
 
 # hide traceback in assertions errors: https://stackoverflow.com/a/27674608/2839786
@@ -0,0 +1,122 @@
+"""
+Concurrency stress test of the answering pipeline
+
+Answers the same questions serially, then from many threads at once (with cold caches),
+and reports the questions whose answers differ between the two runs.
+
+Usage:
+
+    $ python -m kgeqa.utils.stress_test --threads 16 --repeat 4
+    $ python -m kgeqa.utils.stress_test --questions questions.tsv --cache_size 8
+
+The questions are read from `--questions` (see `main.read_questions`), or generated
+from `--n_questions` facts of the KG ("what is the <relation> of <head>?").
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from .. import load_models as models
+from .. import main, model
+from ..cache import LRUCache, PersistentLRUCache
+from ..params import ANSWER_CACHE_SIZE, TOKEN_CACHE_SIZE
+
+
+def questions_from_kg(n: int = 200, seed: int = 0) -> List[str]:
+    """"what is the <relation> of <head>?" for `n` random facts of the KG"""
+    import numpy as np
+
+    facts = models.KG_FACTS
+    rows = np.random.RandomState(seed).choice(len(facts), min(n, len(facts)), replace=False)
+    questions = []
+    for i in rows.tolist():
+        head = facts.entities[int(facts.heads[i])].replace("_", " ")
+        relation = facts.relations[int(facts.relation_codes[i])].replace("_", " ")
+        questions.append(f"what is the {relation} of {head}?")
+    return questions
+
+
+def reset_caches(cache_size: int = 0) -> None:
+    """fresh in-memory caches (the on-disk answers cache is left untouched),
+    of `cache_size` entries each if set, e.g. small enough to force evictions
+    """
+    main.ANSWER_CACHE = PersistentLRUCache(cache_size or ANSWER_CACHE_SIZE)
+    model.EMBEDDING_CACHE = LRUCache(cache_size or TOKEN_CACHE_SIZE)
+    model.NEIGHBORS_CACHE = LRUCache(cache_size or TOKEN_CACHE_SIZE)
+
+
+def _normalized(results: Tuple[str, str, List[str]]) -> tuple:
+    head, relation, result = results
+    return head, relation, result if isinstance(result, str) else tuple(result)
+
+
+def run_serial(questions: List[str]) -> Tuple[List[tuple], float]:
+    start = time.perf_counter()
+    results = [_normalized(main.answer(q)) for q in questions]
+    return results, time.perf_counter() - start
+
+
+def run_threaded(questions: List[str], threads: int) -> Tuple[List[tuple], float]:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = [_normalized(r) for r in executor.map(main.answer, questions)]
+    return results, time.perf_counter() - start
+
+
+def stress_test(
+    questions: List[str], threads: int = 16, repeat: int = 4, cache_size: int = 0
+) -> int:
+    """returns the number of answers differing from the serial run"""
+    import logging
+
+    # -- load the models once, so both runs measure answering only
+    for name in ["EMBEDDING_MODEL", "NEIGHBOR_ENGINE", "KG_FACTS"]:
+        models.get(name)
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        reset_caches(cache_size)
+        expected, serial_time = run_serial(questions)
+        reset_caches(cache_size)
+        # -- each question `repeat` times, interleaved so threads race on the same keys
+        actual, threaded_time = run_threaded(questions * repeat, threads)
+    finally:
+        logging.getLogger().setLevel(level)
+
+    mismatches = 0
+    for i, results in enumerate(actual):
+        question = questions[i % len(questions)]
+        if results != expected[i % len(questions)]:
+            mismatches += 1
+            print(f"MISMATCH: {question!r}\n  serial: {expected[i % len(questions)]}")
+            print(f"  threaded: {results}")
+    print(
+        f"{len(questions)} questions: serial {serial_time:.2f}s, "
+        f"{len(actual)} answers from {threads} threads {threaded_time:.2f}s, "
+        f"{mismatches} mismatches"
+    )
+    return mismatches
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("--questions", help="file of questions (.jsonl or .tsv)")
+    parser.add_argument("--n_questions", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=4)
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=0,
+        help="entries per cache during the test (small values force evictions)",
+    )
+    args = parser.parse_args()
+
+    if args.questions:
+        questions = main.read_questions(args.questions)
+    else:
+        questions = questions_from_kg(args.n_questions)
+    sys.exit(1 if stress_test(questions, args.threads, args.repeat, args.cache_size) else 0)